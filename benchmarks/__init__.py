@@ -0,0 +1,3 @@
+# Register the quasiquotes codec before any of the benchmark modules, which
+# use the quasiquote syntax, are imported.
+import quasiquotes.codec.register  # noqa
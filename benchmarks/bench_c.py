@@ -0,0 +1,110 @@
+# coding: quasiquotes
+import builtins
+import ctypes
+from shutil import rmtree
+from sys import _getframe
+from tempfile import mkdtemp
+
+from quasiquotes.c import c
+from quasiquotes.c.compilers import GCC
+
+
+class TimeCall:
+    """Per-call overhead of trivial quoted c code compared to the same work
+    done in python and through ctypes.
+    """
+    def setup(self):
+        self.qq = qq = c()
+        self.builtins = vars(builtins)
+        self.globals = globals()
+        self.locals = {}
+
+        # compile outside of the timer
+        [$qq|Py_INCREF(Py_None); Py_None|]
+        self.time_quote_stmt()
+        ((self.f, _, _),), = map(dict.values, qq._expr_cache.values())
+
+        self.ctypes_incref = ctypes.pythonapi.Py_IncRef
+        self.ctypes_incref.argtypes = (ctypes.py_object,)
+        self.ctypes_incref.restype = None
+
+    def time_quote_expr(self):
+        qq = self.qq
+        [$qq|Py_INCREF(Py_None); Py_None|]
+
+    def time_quote_stmt(self):
+        qq = self.qq
+        a = None
+        with $qq:
+            Py_INCREF(a);
+            Py_DECREF(a);
+
+    def time_compiled_function(self):
+        self.f(self.builtins, self.globals, self.locals)
+
+    def time_python_equivalent(self):
+        (lambda: None)()
+
+    def time_ctypes_equivalent(self):
+        self.ctypes_incref(None)
+
+
+class TimeResolve:
+    """Looking up the compiled function for a quasiquote.
+
+    ``warm`` hits the in memory cache, ``cold_load`` loads a cached shared
+    object from disk, and ``cold_compile`` runs the compiler.
+    """
+    code = 'Py_INCREF(Py_None); Py_None'
+
+    def setup(self):
+        self.cache_dir = mkdtemp()
+        self.qq = c(cache_dir=self.cache_dir)
+        self.qq._resolve_expr(self.code, _getframe(), 0)
+
+    def teardown(self):
+        rmtree(self.cache_dir)
+
+    def time_warm(self):
+        self.qq._resolve_expr(self.code, _getframe(), 0)
+
+    def time_cold_load(self):
+        c(cache_dir=self.cache_dir)._resolve_expr(self.code, _getframe(), 0)
+
+    def time_cold_compile(self):
+        c(keep_so=False)._resolve_expr(self.code, _getframe(), 0)
+    time_cold_compile.number = 1
+    time_cold_compile.repeat = 5
+
+
+class TimeColdCompile:
+    """Compiling a small quasiquote with and without the precompiled
+    ``Python.h``.
+
+    The precompiled header is built in ``setup`` so that only the compile of
+    the quasiquote itself is timed.
+    """
+    params = [False, True]
+    param_names = ['precompiled_header']
+    code = 'Py_INCREF(Py_None); Py_None'
+
+    def setup(self, precompiled_header):
+        self.cache_dir = mkdtemp()
+        self.compiler = GCC(precompiled_header=precompiled_header)
+        c(
+            keep_so=False,
+            cache_dir=self.cache_dir,
+            compiler=self.compiler,
+        )._resolve_expr('Py_None', _getframe(), 0)
+
+    def teardown(self, precompiled_header):
+        rmtree(self.cache_dir)
+
+    def time_cold_compile(self, precompiled_header):
+        c(
+            keep_so=False,
+            cache_dir=self.cache_dir,
+            compiler=self.compiler,
+        )._resolve_expr(self.code, _getframe(), 0)
+    time_cold_compile.number = 1
+    time_cold_compile.repeat = 5
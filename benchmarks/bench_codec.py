@@ -0,0 +1,25 @@
+import codecs
+
+from quasiquotes.codec.cache import cached_transform
+
+from .bench_tokenizer import _synthetic_source
+
+
+class TimeDecode:
+    """Decoding a source file through the quasiquotes codec.
+    """
+    params = [10, 2000]
+    param_names = ['functions']
+
+    def setup(self, functions):
+        self.source = (
+            '# coding: quasiquotes\n' +
+            _synthetic_source(functions, 0.1)
+        ).encode('utf-8')
+
+    def time_decode_cached(self, functions):
+        codecs.decode(self.source, 'quasiquotes')
+
+    def time_decode_uncached(self, functions):
+        cached_transform.cache_clear()
+        codecs.decode(self.source, 'quasiquotes')
@@ -0,0 +1,34 @@
+import os
+from shutil import rmtree
+from sys import _getframe
+from tempfile import mkdtemp
+
+from quasiquotes import fromfile
+from quasiquotes.c import c
+
+
+class TimeFromfile:
+    """Quasiquotes that read their body from a file.
+    """
+    def setup(self):
+        self.dir = mkdtemp()
+        self.expr_path = os.path.join(self.dir, 'expr.c')
+        with open(self.expr_path, 'w') as f:
+            f.write('Py_INCREF(Py_None); Py_None')
+
+        self.stmt_path = os.path.join(self.dir, 'stmt.c')
+        with open(self.stmt_path, 'w') as f:
+            f.write('Py_INCREF(Py_None);\nPy_DECREF(Py_None);\n')
+
+        self.qq = fromfile(c(cache_dir=self.dir))
+        self.time_quote_expr()  # compile outside of the timer
+        self.time_quote_stmt()
+
+    def teardown(self):
+        rmtree(self.dir)
+
+    def time_quote_expr(self):
+        self.qq.quote_expr(self.expr_path, _getframe(), 0)
+
+    def time_quote_stmt(self):
+        self.qq.quote_stmt(self.stmt_path, _getframe(), 0)
@@ -0,0 +1,73 @@
+from tokenize import untokenize
+
+from quasiquotes.codec.tokenizer import tokenize_string, transform_string
+
+
+def _synthetic_source(functions=2000, density=1.0):
+    """A large module of small functions.
+
+    Parameters
+    ----------
+    functions : int, optional
+        The number of functions in the module.
+    density : float, optional
+        The fraction of the functions which hold a quoted statement and a
+        quoted expression. The rest are plain python.
+    """
+    quoted = (
+        'def f_{n}(a, b):\n'
+        '    c = a + b  # plain python\n'
+        '    with $qq:\n'
+        '        a = PyNumber_Add(a, b);\n'
+        '        if (!a) {{\n'
+        '            return NULL;\n'
+        '        }}\n'
+        '    return [$qq|PyNumber_Or(a, c)|] or (a, [b | c])\n'
+        '\n'
+        '\n'
+    )
+    plain = (
+        'def f_{n}(a, b):\n'
+        '    c = a + b  # plain python\n'
+        '    if not a:\n'
+        '        return None\n'
+        '    return {{a: [b | c]}}\n'
+        '\n'
+        '\n'
+    )
+    every = int(1 / density) if density else None
+    return ''.join(
+        (quoted if every and not n % every else plain).format(n=n)
+        for n in range(functions)
+    )
+
+
+class TimeTokenizer:
+    """Throughput of the quasiquotes tokenizer on a large quasiquoted file.
+    """
+    def setup(self):
+        self.source = _synthetic_source()
+
+    def time_tokenize(self):
+        for _ in tokenize_string(self.source):
+            pass
+
+    def time_untokenize(self):
+        untokenize(tokenize_string(self.source))
+
+    def time_transform_string(self):
+        transform_string(self.source)
+
+
+class TimeTransformString:
+    """``transform_string`` over files of different sizes and quote
+    densities.
+    """
+    params = ([10, 2000], [0, 0.01, 0.1, 1.0])
+    param_names = ['functions', 'density']
+
+    def setup(self, functions, density):
+        self.source = _synthetic_source(functions, density)
+
+    def time_transform_string(self, functions, density):
+        transform_string(self.source)
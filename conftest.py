@@ -0,0 +1,59 @@
+from importlib.util import module_from_spec, spec_from_file_location
+from textwrap import dedent
+
+import pytest
+
+
+def _write_module(dirname, name, source, **kwargs):
+    """Write the source of a python module to a file.
+
+    Parameters
+    ----------
+    dirname : py.path.local
+        The directory to write the module in.
+    name : str
+        The name of the module.
+    source : str
+        The source of the module. This is dedented and then formatted with
+        ``kwargs``.
+    **kwargs
+        The values to format into ``source``.
+
+    Returns
+    -------
+    path : py.path.local
+        The path to the module's source file.
+    """
+    path = dirname.join(name + '.py')
+    path.write(dedent(source).format(**kwargs))
+    return path
+
+
+def _load_module(path):
+    """Execute a python source file as a new module. The module is not added
+    to ``sys.modules``.
+
+    Parameters
+    ----------
+    path : py.path.local
+        The path to the source file.
+
+    Returns
+    -------
+    mod : module
+        The executed module.
+    """
+    spec = spec_from_file_location(path.purebasename, str(path))
+    mod = module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+@pytest.fixture
+def write_module():
+    return _write_module
+
+
+@pytest.fixture
+def load_module():
+    return _load_module
@@ -1,38 +1,62 @@
+from asyncio import Semaphore, gather, get_event_loop
 import builtins
-from distutils.sysconfig import get_python_inc
-from hashlib import md5
-import operator as op
+from collections import OrderedDict, namedtuple
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dis import findlinestarts
+from hashlib import sha256
+from inspect import CO_OPTIMIZED, getsourcefile, iscode, ismodule
 import os
 import re
 from sysconfig import get_config_var
+from sys import _getframe
+from tempfile import mkstemp
 from textwrap import dedent
+from threading import Lock
 from warnings import warn
 
 
-from ._loader import create_callable
+from ._loader import create_callable, create_callables
+from .compilers import GCC, get_compiler
+from .lexer import assigned_names, free_names
+from .. import profiling
 from ..quasiquoter import QuasiQuoter
+from ..utils.cache import cache_dir
 from ..utils.instance import instance
-from ..utils.shell import Executable, Flag
+from ..utils.lock import file_lock
+from ..utils.shell import split_args
+from ..utils.sites import quote_sites
 
 
 builtins_ns = vars(builtins)
-gcc = Executable('gcc')
 
 
 class CompilationError(Exception):
-    """An exception that indicates that gcc failed to compile the given C code.
+    """An exception that indicates that the compiler failed to compile the
+    given C code.
     """
     def __str__(self):
         return '\n' + self.args[0]
 
 
 class CompilationWarning(UserWarning):
-    """A warningthat indicates that gcc warned when compiling the given C code.
+    """A warning that indicates that the compiler warned when compiling the
+    given C code.
     """
     def __str__(self):
         return '\n' + self.args[0]
 
 
+CacheInfo = namedtuple(
+    'CacheInfo',
+    'hits misses evictions entries maxsize',
+)
+
+
 @instance
 class c(QuasiQuoter):
     """quasiquoter for inlining c.
@@ -44,12 +68,41 @@ class c(QuasiQuoter):
     keep_so : bool, optional
         Keep the compiled .so files. Defaults to True.
     extra_compile_args : iterable[str or Flag]
-        Extra command line arguments to pass to gcc.
+        Extra command line arguments to pass to the compiler. Strings are
+        split into words like a shell would split them.
+    cache_dir : str, optional
+        The directory to store compiled shared objects in. This defaults to
+        the ``QUASIQUOTES_CACHE_DIR`` environment variable. If neither is set,
+        shared objects are stored next to the python source that quoted them.
+    compiler : {'gcc', 'tcc'} or Compiler, optional
+        The compiler backend to use. Defaults to 'gcc'. 'tcc' compiles in
+        process with libtcc, which is much faster but does not optimize.
+    first_tier : {'gcc', 'tcc'} or Compiler, optional
+        A fast compiler used to build quoted code the first time it runs.
+        When this is given, the code is rebuilt with ``compiler`` in a
+        background thread and the optimized function replaces the first tier
+        function once it is ready. 'gcc' means gcc without optimizations,
+        ``GCC(optimize=0)``, and 'tcc' means libtcc. This must build
+        different code than ``compiler``.
+    batch : bool, optional
+        Compile every quasiquote in a source file that uses the same
+        quasiquoter into a single shared object. This is built the first
+        time any of the quasiquotes runs. Defaults to False.
+    cache_size : int, optional
+        The maximum number of compiled functions to keep in memory. When
+        this is exceeded the least recently used function is evicted and its
+        shared object is closed once nothing else refers to it. By default
+        the in memory cache is unbounded.
 
     Methods
     -------
     quote_stmt
     quote_expr
+    wait
+    cache_info
+    cache_clear
+    precompile
+    precompile_async
 
     Notes
     -----
@@ -72,33 +125,93 @@ class c(QuasiQuoter):
     This is because of the way the quasiquotes lexer identifies quasiquote
     sections.
     """
-    def __init__(self, *, keep_c=False, keep_so=True, extra_compile_args=()):
+    def __init__(self,
+                 *,
+                 keep_c=False,
+                 keep_so=True,
+                 extra_compile_args=(),
+                 cache_dir=None,
+                 compiler='gcc',
+                 first_tier=None,
+                 batch=False,
+                 cache_size=None):
+        if cache_size is not None and cache_size < 1:
+            raise ValueError(
+                'cache_size must be at least 1, got {!r}'.format(cache_size),
+            )
+
         self._keep_c = keep_c
         self._keep_so = keep_so
-        self._extra_compile_args = tuple(extra_compile_args)
+        self._extra_compile_args = split_args(extra_compile_args)
+        self._cache_dir = cache_dir
+        self._compiler = get_compiler(compiler)
+        if first_tier is not None:
+            if first_tier == 'gcc':
+                # the default gcc is the optimizing tier
+                first_tier = GCC(optimize=0)
+            first_tier = get_compiler(first_tier)
+            if (first_tier.fingerprint(self._extra_compile_args) ==
+                    self._compiler.fingerprint(self._extra_compile_args)):
+                raise ValueError(
+                    'first_tier {!r} builds the same code as compiler'
+                    ' {!r}'.format(first_tier, self._compiler),
+                )
+
+            first_tier = type(self)(
+                keep_c=keep_c,
+                keep_so=keep_so,
+                extra_compile_args=extra_compile_args,
+                cache_dir=cache_dir,
+                compiler=first_tier,
+            )
+        self._first_tier = first_tier
+        self._background = None
+        self._pending = set()
+        self._batch = batch
+        self._batched_files = set()
+        self._batch_keys = {}
+        # the builds that are running in this process, see ``_once``
+        self._building = {}
+        self._building_lock = Lock()
+        self._by_key = {}
+        # the arguments to include the precompiled header, by directory
+        self._headers = {}
+        # functions compiled by ``precompile_async`` which have not been used
+        # yet, keyed by ``_key`` and ordered from oldest to newest; this holds
+        # at most ``cache_size`` functions
+        self._warm = OrderedDict()
         self._stmt_cache = {}
         self._expr_cache = {}
+        self._cache_size = cache_size
+        # maps (kind, f_code, site) to the batch file the function was loaded
+        # from, ordered from least to most recently used
+        self._lru = None if cache_size is None else OrderedDict()
+        # guards ``_lru``, which is updated by every thread that runs a
+        # quasiquote
+        self._lru_lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
 
     def __call__(self, **kwargs):
         return type(self)(**kwargs)
 
-    _basename_template = '_qq_{type}_{base}_{md5}.%s' % get_config_var('SOABI')
-    _missing_name_pattern = re.compile(
-        r'^.+: error: ‘(.+)’ undeclared'
-        r' \(first use in this function\)$',
-        re.MULTILINE,
-    )
-    _error_pattern = re.compile('^.+:\d+: error.*', re.MULTILINE)
+    _soabi = get_config_var('SOABI')
+    _basename_template = '_qq_{type}_{key}.%s' % _soabi
 
-    _read_scope_template = '\n'.join('    ' + l for l in dedent(
+    _name_init_template = '\n'.join('    ' + l for l in dedent(
         """\
-        if (!(__qq_name = PyUnicode_FromString("{name}"))) {{
-            return NULL;
+        if (!(__qq_name_{name} = PyUnicode_InternFromString("{name}"))) {{
+            return -1;
         }}
-        ({name} = PyDict_GetItem(__qq_locals, __qq_name)) ||
-        ({name} = PyDict_GetItem(__qq_globals, __qq_name)) ||
-        ({name} = PyDict_GetItem(__qq_builtins, __qq_name));
-        Py_DECREF(__qq_name);
+        """,
+    ).splitlines())
+
+    _read_scope_template = '\n'.join('    ' + l for l in dedent(
+        """\
+        ({name} = PyDict_GetItem(__qq_locals, __qq_name_{name})) ||
+        ({name} = PyDict_GetItem(__qq_globals, __qq_name_{name})) ||
+        ({name} = PyDict_GetItem(__qq_builtins, __qq_name_{name}));
         if (!{name}) {{
             PyErr_SetString(PyExc_NameError, "name '{name}' is not defined");
             return NULL;
@@ -106,28 +219,66 @@ class c(QuasiQuoter):
         """,
     ).splitlines())
 
+    _header_template = '#include <Python.h>\n'
+
     _shared = dedent(
         """\
         #include <Python.h>
 
+        {namedecls}
+
+        /* Called by the loader to intern the captured names once. */
+        int
+        __qq_init(void)
+        {{
+        {nameinit}
+            return 0;
+        }}
+
+        /* Use the fastcall convention where it is available so that the
+           interpreter does not need to allocate an argument tuple. */
+        #if PY_VERSION_HEX >= 0x03070000
+        #define __QQ_FLAGS METH_FASTCALL
+        static PyObject *
+        __qq_f(PyObject *__qq_self,
+               PyObject *const *__qq_args,
+               Py_ssize_t __qq_nargs)
+        {{
+        #elif PY_VERSION_HEX >= 0x03060000
+        #define __QQ_FLAGS METH_FASTCALL
         static PyObject *
-        __qq_f(PyObject *__qq_self, PyObject *__qq_args)
+        __qq_f(PyObject *__qq_self,
+               PyObject **__qq_args,
+               Py_ssize_t __qq_nargs,
+               PyObject *__qq_kwnames)
         {{
-            PyObject *__qq_name;
+            if (__qq_kwnames && PyTuple_GET_SIZE(__qq_kwnames)) {{
+                PyErr_SetString(PyExc_TypeError,
+                                "quoted func takes no keyword arguments");
+                return NULL;
+            }}
+        #else
+        #define __QQ_FLAGS METH_VARARGS
+        static PyObject *
+        __qq_f(PyObject *__qq_self, PyObject *__qq_argtuple)
+        {{
+            PyObject **__qq_args = &PyTuple_GET_ITEM(__qq_argtuple, 0);
+            Py_ssize_t __qq_nargs = PyTuple_GET_SIZE(__qq_argtuple);
+        #endif
             PyObject *__qq_locals;
             PyObject *__qq_globals;
             PyObject *__qq_builtins;
         {localdecls}
 
-            if (PyTuple_GET_SIZE(__qq_args) != 3) {{
+            if (__qq_nargs != 3) {{
                 PyErr_SetString(PyExc_TypeError,
                                 "quoted func needs 3 args"
                                 " (builtins, globals, locals)");
                 return NULL;
             }}
-            __qq_builtins = PyTuple_GET_ITEM(__qq_args, 0);
-            __qq_globals = PyTuple_GET_ITEM(__qq_args, 1);
-            __qq_locals = PyTuple_GET_ITEM(__qq_args, 2);
+            __qq_builtins = __qq_args[0];
+            __qq_globals = __qq_args[1];
+            __qq_locals = __qq_args[2];
 
         {read_scope}
         """,
@@ -150,7 +301,7 @@ class c(QuasiQuoter):
         }}
 
         PyMethodDef __qq_methoddef = {{
-            "quoted_stmt", (PyCFunction) __qq_f, METH_VARARGS, "",
+            "quoted_stmt", (PyCFunction) __qq_f, __QQ_FLAGS, "",
         }};
         """,
     )
@@ -167,12 +318,60 @@ class c(QuasiQuoter):
         }}
 
         PyMethodDef __qq_methoddef = {{
-            "quoted_expr", (PyCFunction) __qq_f, METH_VARARGS, "",
+            "quoted_expr", (PyCFunction) __qq_f, __QQ_FLAGS, "",
         }};
         """
     )
 
-    def quote_stmt(self, code, frame, col_offset):
+    # Each function in a batch is generated from the normal templates with
+    # its exported symbols renamed.
+    _batch_function_template = dedent(
+        """\
+        #define __qq_f __qq_f_{n}
+        #define __qq_init __qq_init_{n}
+        #define __qq_methoddef __qq_methoddef_{n}
+        {source}
+        #undef __qq_f
+        #undef __qq_init
+        #undef __qq_methoddef
+        """,
+    )
+
+    _batch_template = dedent(
+        """\
+        #include <Python.h>
+
+        {namedecls}
+
+        {functions}
+
+        /* Called by the loader to intern the captured names once. */
+        int
+        __qq_init(void)
+        {{
+        {nameinit}
+            return 0;
+        }}
+
+        PyMethodDef *__qq_methoddefs[] = {{
+        {methoddefs}
+            NULL,
+        }};
+
+        const char *__qq_keys[] = {{
+        {keys}
+            NULL,
+        }};
+        """,
+    )
+
+    def _quote_stmt(self, col_offset, code, site=None, _getframe=_getframe):
+        self.quote_stmt(code, _getframe(1), col_offset, site)
+
+    def _quote_expr(self, col_offset, code, site=None, _getframe=_getframe):
+        return self.quote_expr(code, _getframe(1), col_offset, site)
+
+    def quote_stmt(self, code, frame, col_offset, site=None):
         """Execute inline C code respecting scoping rules.
 
         Parameters
@@ -183,15 +382,39 @@ class c(QuasiQuoter):
             The stackframe this is being executed in.
         col_offset : int
             The column offset of the code.
+        site : int, optional
+            The identifier the codec gave this quasiquote, unique within its
+            source file. When this is not given the quasiquote is identified
+            by its line and column instead.
         """
-        self._resolve_stmt(code, frame, col_offset)(
+        if site is None:
+            site = frame.f_lineno, col_offset
+        try:
+            f, read_locals, write_locals = self._stmt_cache[frame.f_code][site]
+        except KeyError:
+            f, read_locals, write_locals = self._resolve_stmt(
+                code,
+                frame,
+                col_offset,
+                site=site,
+            )
+        else:
+            self._hits += 1
+            if self._lru is not None:
+                self._touch(('stmt', frame.f_code, site))
+            if profiling.enabled:
+                profiling.count('c.cache_hit')
+
+        f_globals = frame.f_globals
+        f(
             builtins_ns,
-            frame.f_globals,
-            frame.f_locals,
+            f_globals,
+            frame.f_locals if read_locals else f_globals,
         )
-        self.locals_to_fast(frame)
+        if write_locals:
+            self.locals_to_fast(frame)
 
-    def quote_expr(self, code, frame, col_offset):
+    def quote_expr(self, code, frame, col_offset, site=None):
         """Execute an inline C expression respecting scoping rules.
 
         Parameters
@@ -202,38 +425,50 @@ class c(QuasiQuoter):
             The stackframe this is being executed in.
         col_offset : int
             The column offset of the code.
+        site : int, optional
+            The identifier the codec gave this quasiquote, unique within its
+            source file. When this is not given the quasiquote is identified
+            by its line and column instead.
 
         Returns
         -------
         result : any
             The result of the C expression.
         """
-        return self._resolve_expr(code, frame, col_offset)(
+        if site is None:
+            site = frame.f_lineno, col_offset
+        try:
+            f, read_locals, _ = self._expr_cache[frame.f_code][site]
+        except KeyError:
+            f, read_locals, _ = self._resolve_expr(
+                code,
+                frame,
+                col_offset,
+                site=site,
+            )
+        else:
+            self._hits += 1
+            if self._lru is not None:
+                self._touch(('expr', frame.f_code, site))
+            if profiling.enabled:
+                profiling.count('c.cache_hit')
+
+        f_globals = frame.f_globals
+        return f(
             builtins_ns,
-            frame.f_globals,
-            frame.f_locals,
+            f_globals,
+            frame.f_locals if read_locals else f_globals,
         )
 
-    @staticmethod
-    def _entry_from_frame(frame, col_offset):
-        """The tuple format for storing cached functions.
-
-        Parameters
-        ----------
-        frame : frame
-            The frame the code is in.
-        col_offset : int
-            The column offset of the code.
-
-        Returns
-        -------
-        entry : tuple
-            The cache key for the code.
-        """
-        return frame.f_code, frame.f_lineno, col_offset
-
-    def _resolve(self, code, frame, col_offset, cache, kind):
-        """Find the function for the given entry.
+    def _resolve(self,
+                 code,
+                 frame,
+                 col_offset,
+                 cache,
+                 kind,
+                 scope=None,
+                 site=None):
+        """Find the function for the given quasiquote.
 
         If the function is not already cached, then create it.
 
@@ -245,107 +480,827 @@ class c(QuasiQuoter):
             The stack frame we are executing in
         col_offset : int
             The column offset of the quasiquoter.
-        cache : dict
-            The cache to use for lookups.
+        cache : dict[code, dict]
+            The cache to use for lookups. This maps code objects to a dict
+            from site to cached function.
         kind : {'expr', 'stmt'}
             The type of quasiquote being invoked.
+        scope : set[str], optional
+            The names visible to the code. Defaults to the names visible
+            from ``frame``.
+        site : hashable, optional
+            The identifier of the quasiquote within ``frame.f_code``.
+            Defaults to the current line and ``col_offset``.
 
         Returns
         -------
         f : callable
             The compiled C function.
+        read_locals : bool
+            Does ``f`` need to be passed the locals of the frame?
+        write_locals : bool
+            Does ``f`` write to the fast locals of the frame?
         """
-        entry = self._entry_from_frame(frame, col_offset)
+        if site is None:
+            site = frame.f_lineno, col_offset
+        try:
+            sites = cache[frame.f_code]
+        except KeyError:
+            # another thread may be resolving a site in the same code object
+            sites = cache.setdefault(frame.f_code, {})
         try:
-            return cache[entry]
+            out = sites[site]
         except KeyError:
             pass
+        else:
+            self._hits += 1
+            if self._lru is not None:
+                self._touch((kind, frame.f_code, site))
+            if profiling.enabled:
+                profiling.count('c.cache_hit')
+            return out
+
+        if not profiling.enabled:
+            return self._resolve_miss(
+                code,
+                frame,
+                col_offset,
+                sites,
+                kind,
+                scope,
+                site,
+            )
 
-        f_code = frame.f_code
-        try:
-            f = cache[entry] = create_callable(
-                self._soname(code, f_code, kind),
+        profiling.count('c.cache_miss')
+        label = self._label(frame.f_code.co_filename, frame.f_lineno)
+        with profiling.timed('resolve', label):
+            out = self._resolve_miss(
+                code,
+                frame,
+                col_offset,
+                sites,
+                kind,
+                scope,
+                site,
             )
-            return f
-        except OSError:
-            pass
 
+        def replace(first_call, f):
+            current = sites.get(site)
+            if current is not None and current[0] is first_call:
+                sites[site] = (f,) + current[1:]
+
+        if sites.get(site) is out:
+            out = sites[site] = (
+                profiling.time_first_call(label, out[0], replace),
+            ) + out[1:]
+        return out
+
+    @staticmethod
+    def _label(filename, lineno):
+        return '{}:{}'.format(filename, lineno)
+
+    def _resolve_miss(self,
+                      code,
+                      frame,
+                      col_offset,
+                      cache,
+                      kind,
+                      scope,
+                      entry):
+        """Create and cache the function for an entry which is not in the
+        in memory cache. See ``_resolve``.
+        """
+        if scope is None:
+            scope = self._scope(frame)
+        names = free_names(code, scope)
+        usage = self._locals_usage(code, frame, kind, names)
+        filename = frame.f_code.co_filename
+        lineno = frame.f_lineno
+        f = batch = None
+        if self._batch:
+            f = self._load_batched(code, kind, col_offset, names, filename)
+            if f is not None:
+                batch = filename
+        if f is None:
+            f = self._load_or_make_func(
+                cache,
+                entry,
+                usage,
+                code,
+                kind,
+                names,
+                filename,
+                lineno,
+            )
+
+        out = cache[entry] = (f,) + usage
+        self._misses += 1
+        lru = self._lru
+        if lru is not None:
+            with self._lru_lock:
+                lru[kind, frame.f_code, entry] = batch
+                while len(lru) > self._cache_size:
+                    self._evict(*lru.popitem(last=False))
+        return out
+
+    def _touch(self, key):
+        """Mark a function in the bounded in memory cache as the most recently
+        used.
+
+        Parameters
+        ----------
+        key : tuple[str, code, hashable]
+            The kind, code object, and site of the function.
+        """
+        with self._lru_lock:
+            try:
+                self._lru.move_to_end(key)
+            except KeyError:
+                # evicted by another thread after this one found it
+                pass
+
+    def _evict(self, key, batch):
+        """Drop a function from the in memory cache.
+
+        Parameters
+        ----------
+        key : tuple[str, code, hashable]
+            The kind, code object, and site of the function.
+        batch : str or None
+            The source file of the batch the function was loaded from.
+
+        Notes
+        -----
+        The loader closes a shared object when the last function created
+        from it is deallocated. Functions from a batch share one shared
+        object, so evicting any of them forgets the whole batch; it is loaded
+        again if another quasiquote in the batch runs.
+        """
+        kind, f_code, site = key
+        cache = self._stmt_cache if kind == 'stmt' else self._expr_cache
+        sites = cache.get(f_code)
+        if sites is not None:
+            sites.pop(site, None)
+            if not sites:
+                del cache[f_code]
+
+        if batch is not None:
+            self._batched_files.discard(batch)
+            for batch_key in self._batch_keys.pop(batch, ()):
+                self._by_key.pop(batch_key, None)
+
+        self._evictions += 1
+
+    def cache_info(self):
+        """Statistics about the in memory cache of compiled functions.
+
+        Returns
+        -------
+        info : CacheInfo
+            The number of cache ``hits``, ``misses``, and ``evictions``, the
+            number of ``entries`` in the cache and its ``maxsize``, which is
+            None when the cache is unbounded.
+        """
+        return CacheInfo(
+            self._hits,
+            self._misses,
+            self._evictions,
+            sum(map(len, self._stmt_cache.values())) +
+            sum(map(len, self._expr_cache.values())),
+            self._cache_size,
+        )
+
+    def cache_clear(self):
+        """Drop every compiled function from the in memory cache and reset
+        the statistics. The shared objects on disk are not removed.
+        """
+        self._shutdown_background()
+        self._stmt_cache.clear()
+        self._expr_cache.clear()
+        self._batched_files.clear()
+        self._batch_keys.clear()
+        self._by_key.clear()
+        self._warm.clear()
+        if self._lru is not None:
+            with self._lru_lock:
+                self._lru.clear()
+        self._hits = self._misses = self._evictions = 0
+
+    def _load_or_make_func(self,
+                           cache,
+                           entry,
+                           usage,
+                           code,
+                           kind,
+                           names,
+                           filename,
+                           lineno):
+        if self._warm:
+            f = self._warm.pop(self._key(code, kind, names), None)
+            if f is not None:
+                return f
+
+        label = self._label(filename, lineno)
         try:
-            f = cache[entry] = self._compile(code, f_code, kind)
-            return f
-        except FileNotFoundError:
+            with profiling.timed('load', label):
+                return self._load(code, kind, names, filename)
+        except OSError:
             pass
 
-        f = cache[entry] = self._make_func(code, frame, col_offset, kind)
+        first_tier = self._first_tier
+        if first_tier is None:
+            return self._make_func(code, kind, names, filename, lineno)
+
+        try:
+            with profiling.timed('load', label):
+                f = first_tier._load(code, kind, names, filename)
+        except OSError:
+            f = first_tier._make_func(code, kind, names, filename, lineno)
+        self._optimize(
+            cache,
+            entry,
+            usage,
+            code,
+            kind,
+            names,
+            filename,
+            lineno,
+        )
         return f
 
-    def _dir_and_basename(self, code, f_code, kind):
-        filename = f_code.co_filename
+    def _optimize(self,
+                  cache,
+                  entry,
+                  usage,
+                  code,
+                  kind,
+                  names,
+                  filename,
+                  lineno):
+        """Rebuild a first tier function with the optimizing compiler in a
+        background thread.
+
+        Parameters
+        ----------
+        cache : dict
+            The cache that holds the first tier function.
+        entry : hashable
+            The key of the function in ``cache``.
+        usage : tuple[bool, bool]
+            The locals usage of the code, see ``_locals_usage``.
+        code : str
+            The user code.
+        kind : {'stmt', 'expr'}
+            The type of quasiquote.
+        names : iterable[str]
+            The names captured from the enclosing scope.
+        filename : str
+            The python source file that the code appears in.
+        lineno : int
+            The line in ``filename`` that the code starts on.
+        """
+        def build():
+            try:
+                f = self._make_func(code, kind, names, filename, lineno)
+            except CompilationError as e:
+                warn(CompilationWarning(
+                    'failed to optimize quoted code at {}:{}, the first tier'
+                    ' function will be kept:\n{}'.format(
+                        filename,
+                        lineno,
+                        e.args[0],
+                    ),
+                ))
+            else:
+                # a single item assignment is atomic, callers will see either
+                # the first tier or the optimized function; entries that were
+                # evicted during the build are not brought back
+                if entry in cache:
+                    cache[entry] = (f,) + usage
+
+        with self._building_lock:
+            if self._background is None:
+                self._background = ThreadPoolExecutor(os.cpu_count() or 1)
+            future = self._background.submit(build)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+    def _shutdown_background(self):
+        """Release the threads that run optimized builds once the builds that
+        were already submitted finish. New threads are started by the next
+        build.
+        """
+        with self._building_lock:
+            background, self._background = self._background, None
+        if background is not None:
+            background.shutdown(wait=False)
+
+    def wait(self, timeout=None):
+        """Wait for the optimized builds of first tier functions to finish.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum number of seconds to wait.
+
+        Returns
+        -------
+        done : bool
+            Did all of the builds finish?
+        """
+        _, not_done = wait(tuple(self._pending), timeout)
+        return not not_done
+
+    @staticmethod
+    def _locals_usage(code, frame, kind, names):
+        """Find out how a quoted block uses the locals of a stackframe.
+
+        Parameters
+        ----------
+        code : str
+            The user code.
+        frame : frame
+            The frame the code is in.
+        kind : {'stmt', 'expr'}
+            The type of quasiquote.
+        names : iterable[str]
+            The names captured from the enclosing scope.
+
+        Returns
+        -------
+        read_locals : bool
+            Does the code need to be passed ``frame.f_locals``? When this is
+            False, the globals may be passed in place of the locals.
+        write_locals : bool
+            Does the code write to the fast locals of ``frame``, meaning
+            ``locals_to_fast`` must be called after it runs?
+
+        Notes
+        -----
+        Reading ``f_locals`` of a function's frame copies every fast local
+        into a dict, so we avoid it when none of the captured names are
+        locals.
+        """
+        f_code = frame.f_code
+        if not f_code.co_flags & CO_OPTIMIZED:
+            # module and class bodies store their locals in a real dict
+            return True, False
+
+        local_names = set(f_code.co_varnames)
+        local_names.update(f_code.co_cellvars)
+        local_names.update(f_code.co_freevars)
+        assigned = assigned_names(code, names) if kind == 'stmt' else ()
+        write_locals = not local_names.isdisjoint(assigned)
+        return (
+            # Writes to non-local names are dropped into a copy of the locals
+            # so that we never write to the globals.
+            bool(assigned) or not local_names.isdisjoint(names),
+            write_locals,
+        )
+
+    @staticmethod
+    def _scope(frame):
+        """The names that are visible from a stackframe.
+
+        Parameters
+        ----------
+        frame : frame
+            The frame to inspect.
+
+        Returns
+        -------
+        scope : set[str]
+            The local, global, and builtin names, including locals which have
+            not yet been bound.
+        """
+        f_code = frame.f_code
+        scope = set(frame.f_locals)
+        scope.update(f_code.co_varnames)
+        scope.update(f_code.co_cellvars)
+        scope.update(f_code.co_freevars)
+        scope.update(frame.f_globals)
+        scope.update(builtins_ns)
+        return scope
+
+    def _key(self, code, kind, names):
+        """The content address of a quoted block.
+
+        Parameters
+        ----------
+        code : str
+            The user code.
+        kind : {'stmt', 'expr'}
+            The type of quasiquote.
+        names : iterable[str]
+            The names captured from the enclosing scope.
+
+        Returns
+        -------
+        key : str
+            A hash of the generated C source along with everything about the
+            toolchain that affects the compiled shared object.
+        """
+        template = (
+            self._stmt_template if kind == 'stmt' else self._expr_template
+        )
+        h = sha256()
+        for part in (
+                template,
+                code,
+                ' '.join(names),
+                self._compiler.fingerprint(self._extra_compile_args),
+                self._soabi):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _dir(self, filename):
+        path = cache_dir('c', root=self._cache_dir)
+        if path is None:
+            path = os.path.abspath(os.path.dirname(filename))
+        return path
+
+    def _dir_and_basename(self, code, filename, kind, names):
         return (
-            os.path.abspath(os.path.dirname(filename)),
+            self._dir(filename),
             self._basename_template.format(
                 type=kind,
-                base=os.path.basename(filename).split('.', 1)[0],
-                md5=md5(code.encode('utf-8')).hexdigest(),
+                key=self._key(code, kind, names),
             ),
         )
 
-    def _soname(self, code, f_code, kind):
+    def _soname(self, code, filename, kind, names):
         return os.path.join(
-            *self._dir_and_basename(code, f_code, kind)
+            *self._dir_and_basename(code, filename, kind, names)
         ) + '.so'
 
-    def _cname(self, code, f_code, kind):
-        return os.path.join(
-            *self._dir_and_basename(code, f_code, kind)
-        ) + '.c'
-
-    def _resolve_stmt(self, code, frame, col_offset):
+    def _resolve_stmt(self, code, frame, col_offset, scope=None, site=None):
         return self._resolve(
-            code, frame, col_offset, self._stmt_cache, 'stmt',
+            code, frame, col_offset, self._stmt_cache, 'stmt', scope, site,
         )
 
-    def _resolve_expr(self, code, frame, col_offset):
+    def _resolve_expr(self, code, frame, col_offset, scope=None, site=None):
         return self._resolve(
-            code, frame, col_offset, self._expr_cache, 'expr',
+            code, frame, col_offset, self._expr_cache, 'expr', scope, site,
+        )
+
+    def _load_batched(self, code, kind, col_offset, names, filename):
+        """Look up a C function in the batch for a source file.
+
+        Parameters
+        ----------
+        code : str
+            The user code.
+        kind : {'stmt', 'expr'}
+            The type of function to load.
+        col_offset : int
+            The column offset of the quasiquoter.
+        names : iterable[str]
+            The names to capture from the closing scope.
+        filename : str
+            The python source file that the code appears in.
+
+        Returns
+        -------
+        f : callable or None
+            The C function from user code, or None if the code is not part
+            of a batch.
+
+        Notes
+        -----
+        The first lookup for each file builds or loads the batch for all of
+        the quasiquotes in the file which use the same quasiquoter name as
+        this one.
+        """
+        if filename not in self._batched_files:
+            self._once(
+                ('batch', filename),
+                self._load_batch_file,
+                code,
+                kind,
+                col_offset,
+                filename,
+            )
+
+        return self._by_key.get(self._key(code, kind, names))
+
+    def _load_batch_file(self, code, kind, col_offset, filename):
+        """Load the batch that holds a quasiquote. See ``_load_batched``.
+        """
+        try:
+            with open(filename, 'rb') as f:
+                source = f.read()
+        except OSError:
+            # not a real file, for example: '<stdin>'
+            pass
+        else:
+            sites = quote_sites(source.decode('utf-8'), filename)
+            for site in sites:
+                if (site.kind == kind and
+                        site.col_offset == col_offset and
+                        site.code == code):
+                    jobs = self._batch_jobs(
+                        s for s in sites if s.name == site.name
+                    )
+                    fs = self._load_batch(jobs, filename)
+                    self._by_key.update(fs)
+                    self._batch_keys[filename] = tuple(fs)
+                    break
+
+        self._batched_files.add(filename)
+
+    def _batch_jobs(self, sites):
+        """Collect the functions to compile into a batch.
+
+        Parameters
+        ----------
+        sites : iterable[QuoteSite]
+            The quasiquotes to put in the batch.
+
+        Returns
+        -------
+        jobs : dict[str, (str, str, tuple[str], int)]
+            A map from the key of each function to the code, kind, names,
+            and lineno to build it with.
+        """
+        jobs = {}
+        for site in sites:
+            names = free_names(site.code, site.scope)
+            jobs.setdefault(
+                self._key(site.code, site.kind, names),
+                (site.code, site.kind, names, site.lineno),
+            )
+        return jobs
+
+    def _batch_dir_and_basename(self, jobs, filename):
+        h = sha256()
+        for part in (self._batch_template,) + tuple(sorted(jobs)):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return (
+            self._dir(filename),
+            self._basename_template.format(type='batch', key=h.hexdigest()),
+        )
+
+    def _load_batch(self, jobs, filename):
+        """Load the batch of functions for a source file, building it if it
+        is not cached.
+
+        Parameters
+        ----------
+        jobs : dict[str, (str, str, tuple[str], int)]
+            The functions in the batch, see ``_batch_jobs``.
+        filename : str
+            The python source file that the code appears in.
+
+        Returns
+        -------
+        fs : dict[str, callable]
+            A map from the key of each function to the function.
+        """
+        if not jobs:
+            return {}
+
+        dirname, basename = self._batch_dir_and_basename(jobs, filename)
+        soname = os.path.join(dirname, basename) + '.so'
+        label = filename + ' (batch)'
+        try:
+            with profiling.timed('load', label):
+                return create_callables(soname)
+        except OSError:
+            # a shared object that exists but did not load is rebuilt
+            stale = _stat(soname)
+
+        try:
+            with profiling.timed('compile', label):
+                soname = self._build_batch(jobs, filename, stale)
+        except CompilationError:
+            # Fall back to compiling each function on its own so that the
+            # error is reported by the quasiquote that caused it.
+            return {}
+
+        with profiling.timed('load', label):
+            fs = create_callables(soname)
+        if not self._keep_so:
+            os.remove(soname)
+        return fs
+
+    def _build_batch(self, jobs, filename, stale=None):
+        """Generate and compile a shared object holding many functions.
+
+        Parameters
+        ----------
+        jobs : dict[str, (str, str, tuple[str], int)]
+            The functions in the batch, see ``_batch_jobs``.
+        filename : str
+            The python source file that the code appears in.
+        stale : os.stat_result, optional
+            The cached shared object which could not be loaded, see
+            ``_build_source``.
+
+        Returns
+        -------
+        soname : str
+            The path to the compiled shared object. If ``keep_so`` is False
+            then this is a temporary file which the caller should remove.
+        """
+        return self._build_source(
+            self._batch_source(jobs, filename),
+            *self._batch_dir_and_basename(jobs, filename),
+            stale=stale
         )
 
-    def _make_func(self,
-                   code,
-                   frame,
-                   col_offset,
-                   kind,
-                   *,
-                   names=(),
-                   _first=True):
+    def _batch_source(self, jobs, filename):
+        keys = sorted(jobs)
+        all_names = sorted({name for key in keys for name in jobs[key][2]})
+        return self._batch_template.format(
+            namedecls=self._namedecls(all_names),
+            nameinit=self._nameinit(all_names),
+            functions='\n'.join(
+                self._batch_function_template.format(
+                    n=n,
+                    source=self._source(
+                        code,
+                        kind,
+                        names,
+                        filename,
+                        lineno,
+                        declare_names=False,
+                    ),
+                )
+                for n, (code, kind, names, lineno) in enumerate(
+                    map(jobs.__getitem__, keys),
+                )
+            ),
+            methoddefs='\n'.join(
+                '    &__qq_methoddef_{},'.format(n) for n in range(len(keys))
+            ),
+            keys='\n'.join(map('    "{}",'.format, keys)),
+        )
+
+    def _load(self, code, kind, names, filename):
+        """Load a cached C function.
+
+        Parameters
+        ----------
+        code : str
+            The user code.
+        kind : {'stmt', 'expr'}
+            The type of function to load.
+        names : iterable[str]
+            The names to capture from the closing scope.
+        filename : str
+            The python source file that the code appears in.
+
+        Returns
+        -------
+        f : callable
+            The C function from user code.
+
+        Raises
+        ------
+        OSError
+            Raised when the shared object is not cached.
+        """
+        return create_callable(self._soname(code, filename, kind, names))
+
+    def _make_func(self, code, kind, names, filename, lineno):
         """Create the C function based off of the user code.
 
         Parameters
         ----------
         code : str
             The user code to use to create the function.
-        frame : frame
-            The first stackframe where this code is being compiled.
-        col_offset : int
-            The column offset of the code.
         kind : {'stmt', 'expr'}
             The type of function to create.
-        names : iterable[str], optional
+        names : iterable[str]
             The names to capture from the closing scope.
+        filename : str
+            The python source file that the code appears in.
+        lineno : int
+            The line in ``filename`` that the code starts on.
 
         Returns
         -------
         f : callable
             The C function from user code.
+
+        Notes
+        -----
+        When many threads need the same function at once, only one of them
+        builds it and the others wait for and share its result.
+        """
+        return self._once(
+            ('func', self._key(code, kind, names)),
+            self._build_and_load,
+            code,
+            kind,
+            names,
+            filename,
+            lineno,
+        )
+
+    def _build_and_load(self, code, kind, names, filename, lineno):
+        label = self._label(filename, lineno)
+        soname = self._build(code, kind, names, filename, lineno)
+        try:
+            with profiling.timed('load', label):
+                f = create_callable(soname)
+        except OSError:
+            if not self._keep_so:
+                raise
+            # the cached shared object is truncated or stale, replace it
+            soname = self._build(
+                code,
+                kind,
+                names,
+                filename,
+                lineno,
+                stale=_stat(soname),
+            )
+            with profiling.timed('load', label):
+                f = create_callable(soname)
+        if not self._keep_so:
+            os.remove(soname)
+        return f
+
+    def _once(self, key, f, *args):
+        """Call a function unless another thread is already calling it for
+        the same key, in which case wait for and return that call's result.
+
+        Parameters
+        ----------
+        key : hashable
+            The key that identifies the work.
+        f : callable
+            The function to call.
+        *args
+            The arguments to call ``f`` with.
+
+        Returns
+        -------
+        result : any
+            The result of ``f(*args)``.
+        """
+        with self._building_lock:
+            future = self._building.get(key)
+            owner = future is None
+            if owner:
+                future = self._building[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = f(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._building_lock:
+                del self._building[key]
+
+    def _source(self,
+                code,
+                kind,
+                names,
+                filename,
+                lineno,
+                declare_names=True):
+        """Generate the C source for some user code.
+
+        Parameters
+        ----------
+        code : str
+            The user code to use to create the function.
+        kind : {'stmt', 'expr'}
+            The type of function to create.
+        names : iterable[str]
+            The names to capture from the closing scope.
+        filename : str
+            The python source file that the code appears in.
+        lineno : int
+            The line in ``filename`` that the code starts on.
+        declare_names : bool, optional
+            Declare and intern the static names for ``names``. This is False
+            when the names are declared once for an entire batch.
+
+        Returns
+        -------
+        source : str
+            The C source of the function.
         """
         if kind == 'stmt':
             template = self._stmt_template
             extra_template_args = {
                 'localassign': '\n'.join(
                     map(
-                        '    {0} && PyDict_SetItemString(__qq_locals,'
-                        ' "{0}", {0});'.format,
-                        names,
+                        '    {0} && PyDict_SetItem(__qq_locals,'
+                        ' __qq_name_{0}, {0});'.format,
+                        assigned_names(code, names),
                     ),
                 ),
             }
@@ -357,78 +1312,270 @@ class c(QuasiQuoter):
                 "incorrect kind ('{}') must be 'stmt' or 'expr'".format(kind),
             )
 
-        cname = self._cname(code, frame.f_code, kind)
-        with open(cname, 'w+') as f:
-            f.write(template.format(
-                fmt='"{}"'.format('O' * len(names)),
-                keywords=(
-                    '{' + ', '.join(map('"{}"'.format, names)) + ', NULL}'
-                ),
-                kwargs=', '.join(map('&{}'.format, names)),
-                localdecls='\n'.join(
-                    map('    PyObject *{} = NULL;'.format, names),
-                ),
-                read_scope='\n'.join(
-                    self._read_scope_template.format(name=name)
-                    for name in names,
-                ),
-                lineno=frame.f_lineno,
-                filename=frame.f_code.co_filename,
-                code=code,
-                **extra_template_args
-            ))
-            f.flush()
+        return template.format(
+            fmt='"{}"'.format('O' * len(names)),
+            keywords=(
+                '{' + ', '.join(map('"{}"'.format, names)) + ', NULL}'
+            ),
+            kwargs=', '.join(map('&{}'.format, names)),
+            namedecls=self._namedecls(names) if declare_names else '',
+            nameinit=self._nameinit(names) if declare_names else '',
+            localdecls='\n'.join(
+                map('    PyObject *{} = NULL;'.format, names),
+            ),
+            read_scope='\n'.join(
+                self._read_scope_template.format(name=name)
+                for name in names
+            ),
+            lineno=lineno,
+            filename=filename,
+            code=code,
+            **extra_template_args
+        )
+
+    @staticmethod
+    def _namedecls(names):
+        return '\n'.join(map('static PyObject *__qq_name_{};'.format, names))
 
+    @classmethod
+    def _nameinit(cls, names):
+        return '\n'.join(
+            cls._name_init_template.format(name=name) for name in names
+        )
+
+    def _build(self, code, kind, names, filename, lineno, stale=None):
+        """Generate and compile the shared object for some user code.
+
+        Parameters
+        ----------
+        code : str
+            The user code to use to create the function.
+        kind : {'stmt', 'expr'}
+            The type of function to create.
+        names : iterable[str]
+            The names to capture from the closing scope.
+        filename : str
+            The python source file that the code appears in.
+        lineno : int
+            The line in ``filename`` that the code starts on.
+        stale : os.stat_result, optional
+            The cached shared object which could not be loaded, see
+            ``_build_source``.
+
+        Returns
+        -------
+        soname : str
+            The path to the compiled shared object. If ``keep_so`` is False
+            then this is a temporary file which the caller should remove.
+        """
+        with profiling.timed('compile', self._label(filename, lineno)):
+            return self._build_source(
+                self._source(code, kind, names, filename, lineno),
+                *self._dir_and_basename(code, filename, kind, names),
+                stale=stale
+            )
+
+    def _build_source(self, source, dirname, basename, stale=None):
+        """Compile generated C source into a shared object.
+
+        Parameters
+        ----------
+        source : str
+            The C source.
+        dirname : str
+            The directory to write the shared object to.
+        basename : str
+            The name of the shared object without the extension.
+        stale : os.stat_result, optional
+            The status of a cached shared object which could not be loaded,
+            for example because it was truncated. It is replaced unless
+            another process already replaced it.
+
+        Returns
+        -------
+        soname : str
+            The path to the compiled shared object. If ``keep_so`` is False
+            then this is a temporary file which the caller should remove.
+
+        Notes
+        -----
+        The source and shared object are built under unique temporary names
+        and then atomically renamed into place so that many processes may
+        share a single cache directory. When the shared object is kept, the
+        build holds a lock on ``basename + '.lock'`` so that processes which
+        need the same shared object at the same time build it once. The lock
+        file is left in place: removing it while other processes wait on it
+        would let a new process lock a new file at the same path.
+        """
+        if not self._keep_so:
+            return self._build_tmp(source, dirname, basename)
+
+        path = os.path.join(dirname, basename)
+        soname = path + '.so'
+        with file_lock(path + '.lock'):
+            # the shared object may have been built by another process while
+            # we waited for the lock
+            if not _is_built(soname, stale):
+                os.replace(self._build_tmp(source, dirname, basename), soname)
+            return soname
+
+    async def _build_source_async(self,
+                                  source,
+                                  dirname,
+                                  basename,
+                                  stale=None):
+        """Compile generated C source into a shared object without blocking
+        the event loop. See ``_build_source``.
+
+        Notes
+        -----
+        This does not take the file lock, waiting for it would block the
+        event loop. Processes that race to build the same shared object
+        still write it atomically.
+        """
+        if not self._keep_so:
+            return await self._build_tmp_async(source, dirname, basename)
+
+        soname = os.path.join(dirname, basename) + '.so'
+        if not _is_built(soname, stale):
+            os.replace(
+                await self._build_tmp_async(source, dirname, basename),
+                soname,
+            )
+        return soname
+
+    def _build_tmp(self, source, dirname, basename):
+        """Compile generated C source into a shared object with a unique
+        temporary name. See ``_build_source``.
+        """
+        tmp_cname, tmp_soname = self._write_tmp(source, dirname)
         try:
-            return self._compile(code, frame.f_code, kind)
-        except CompilationError as e:
-            if not _first:
-                try:
-                    os.remove(cname)
-                except FileNotFoundError:
-                    pass
-                raise
-            return self._make_func(
-                code,
-                frame,
-                col_offset,
-                kind,
-                names=tuple(map(
-                    op.methodcaller('group', 1),
-                    self._missing_name_pattern.finditer(str(e)),
-                )),
-                _first=False,
+            self._compile(tmp_cname, tmp_soname)
+        except CompilationError:
+            os.remove(tmp_cname)
+            raise
+
+        self._finish_tmp(tmp_cname, dirname, basename)
+        return tmp_soname
+
+    async def _build_tmp_async(self, source, dirname, basename):
+        tmp_cname, tmp_soname = self._write_tmp(source, dirname)
+        try:
+            await self._compile_async(tmp_cname, tmp_soname)
+        except CompilationError:
+            os.remove(tmp_cname)
+            raise
+
+        self._finish_tmp(tmp_cname, dirname, basename)
+        return tmp_soname
+
+    @staticmethod
+    def _write_tmp(source, dirname):
+        fd, tmp_cname = mkstemp(prefix='_qq_tmp_', suffix='.c', dir=dirname)
+        with open(fd, 'w') as f:
+            f.write(source)
+        return tmp_cname, tmp_cname[:-len('.c')] + '.so'
+
+    def _finish_tmp(self, tmp_cname, dirname, basename):
+        if self._keep_c:
+            os.replace(tmp_cname, os.path.join(dirname, basename) + '.c')
+        else:
+            os.remove(tmp_cname)
+
+    def _compile(self, cname, soname):
+        """Compile a C source file into a shared object.
+
+        Parameters
+        ----------
+        cname : str
+            The path to the C source.
+        soname : str
+            The path to write the shared object to.
+
+        Raises
+        ------
+        CompilationError
+            Raised when the compiler fails to compile the source.
+        """
+        self._check(*self._compiler.compile(
+            cname,
+            soname,
+            self._extra_compile_args +
+            self._header_args(os.path.dirname(cname)),
+        ))
+
+    async def _compile_async(self, cname, soname):
+        dirname = os.path.dirname(cname)
+        header_args = self._headers.get(dirname)
+        if header_args is None:
+            header_args = await get_event_loop().run_in_executor(
+                None,
+                self._header_args,
+                dirname,
             )
 
-    def _compile(self, code, f_code, kind):
-        cname = self._cname(code, f_code, kind)
-        soname = self._soname(code, f_code, kind)
-        os.stat(cname)  # raises FileNotFoundError if doesn't exist
-        _, err, status = gcc(
-            Flag.O(3),
-            Flag.I(get_python_inc()),
-            Flag.f('PIC'),
-            Flag.std('gnu11'),
-            Flag.shared,
-            Flag.o(soname),
-            *(repr(cname),) + self._extra_compile_args
+        self._check(*await self._compiler.compile_async(
+            cname,
+            soname,
+            self._extra_compile_args + header_args,
+        ))
+
+    def _header_args(self, dirname):
+        """Get the compiler arguments that include a precompiled
+        ``Python.h``, building it if needed.
+
+        Parameters
+        ----------
+        dirname : str
+            The directory that the shared objects are built in. The header
+            is cached in the ``pch`` directory of the cache root, or alongside
+            the shared objects if there is no cache root.
+
+        Returns
+        -------
+        args : tuple[str or Flag]
+            The extra compiler arguments. This is empty if the compiler does
+            not support precompiled headers.
+        """
+        try:
+            return self._headers[dirname]
+        except KeyError:
+            pass
+
+        args = self._headers[dirname] = self._once(
+            ('header', dirname),
+            self._build_header,
+            dirname,
         )
-        if not self._keep_c:
-            os.remove(cname)
+        return args
+
+    def _build_header(self, dirname):
+        h = sha256()
+        for part in (self._header_template,
+                     self._compiler.fingerprint(self._extra_compile_args)):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        path = cache_dir('pch', root=self._cache_dir) or dirname
+        header = os.path.join(
+            path,
+            self._basename_template.format(type='header', key=h.hexdigest()),
+        ) + '.h'
+        return tuple(self._compiler.precompile_header(
+            header,
+            self._header_template,
+            self._extra_compile_args,
+        ))
+
+    @staticmethod
+    def _check(err, status):
         if status:
             raise CompilationError(err)
         elif err:
             warn(CompilationWarning(err))
 
-        f = create_callable(soname)
-
-        if not self._keep_so:
-            os.remove(soname)
-        return f
-
     def cleanup(self, path='.', recurse=True):
-        """Remove cached shared objects and c code generated by the
-        c quasiquoter.
+        """Remove cached shared objects, c code, and precompiled headers
+        generated by the c quasiquoter.
 
         Parameters
         ----------
@@ -442,21 +1589,342 @@ class c(QuasiQuoter):
         removed : list[str]
             The paths to the files that were removed.
         """
-        paths = (
+        self._shutdown_background()
+        pattern = re.compile(r'_qq_.+\.(c|so|lock|h|gch)$')
+        removed = []
+        for p in self._paths(path, recurse):
+            if pattern.match(os.path.basename(p)):
+                removed.append(p)
+                os.remove(p)
+
+        return removed
+
+    @staticmethod
+    def _paths(path, recurse):
+        if os.path.isfile(path):
+            return (path,)
+
+        return (
             os.path.join(parent, f)
             for parent, _, fs in os.walk(path)
             for f in fs
         ) if recurse else (
             os.path.join(path, f) for f in os.listdir(path)
         )
-        pattern = re.compile(r'.*_qq_.+.+\.(c|so)$')
-        removed = []
-        for p in paths:
-            if pattern.match(p):
-                removed.append(p)
-                os.remove(p)
 
-        return removed
+    _coding_pattern = re.compile(
+        br'^[ \t\f]*#.*?coding[:=][ \t]*quasiquotes\b',
+        re.MULTILINE,
+    )
+
+    def precompile(self,
+                   path='.',
+                   recurse=True,
+                   quasiquoters=('c',),
+                   processes=None):
+        """Compile all of the quoted c code in some python source ahead of
+        time.
+
+        Parameters
+        ----------
+        path : str, optional
+            The path to the directory or file that will be searched.
+        recurse : bool, optional
+            Should the search recurse through subdirectories of ``path``.
+        quasiquoters : iterable[str], optional
+            The names that this quasiquoter is bound to in the source.
+        processes : int, optional
+            The number of compilers to run at once. Defaults to the number
+            of cpus.
+
+        Returns
+        -------
+        compiled : list[str]
+            The paths to the shared objects that were compiled.
+
+        Notes
+        -----
+        Only files that are marked with ``# coding: quasiquotes`` are
+        searched. Shared objects that are already cached are not rebuilt.
+        If this quasiquoter was constructed with ``batch=True`` then one
+        shared object is built for each file.
+
+        The compiled code is cached for quasiquoters that are constructed
+        with the same arguments as this one.
+        """
+        quasiquoters = frozenset(quasiquoters)
+        jobs = {}
+        for p in self._paths(path, recurse):
+            if not p.endswith('.py'):
+                continue
+
+            with open(p, 'rb') as f:
+                source = f.read()
+
+            if not self._coding_pattern.search(
+                    b'\n'.join(source.split(b'\n', 2)[:2])):
+                continue
+
+            sites = [
+                site for site in quote_sites(source.decode('utf-8'), p)
+                if site.name in quasiquoters
+            ]
+            if self._batch:
+                batch = self._batch_jobs(sites)
+                if batch:
+                    soname = os.path.join(
+                        *self._batch_dir_and_basename(batch, p)
+                    ) + '.so'
+                    if not os.path.exists(soname):
+                        jobs[soname] = _precompile_batch, (batch, p)
+                continue
+
+            for site in sites:
+                names = free_names(site.code, site.scope)
+                soname = self._soname(site.code, p, site.kind, names)
+                if soname in jobs or os.path.exists(soname):
+                    continue
+
+                jobs[soname] = _precompile, (
+                    site.code,
+                    site.kind,
+                    names,
+                    p,
+                    site.lineno,
+                )
+
+        kwargs = {
+            'keep_c': self._keep_c,
+            'extra_compile_args': self._extra_compile_args,
+            'cache_dir': self._cache_dir,
+            'compiler': self._compiler,
+        }
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [
+                pool.submit(f, kwargs, *args) for f, args in jobs.values()
+            ]
+            return [future.result() for future in futures]
+
+    async def precompile_async(self, obj, quasiquoters=None, processes=None):
+        """Compile and load the quoted c code in a module or function without
+        blocking the event loop.
+
+        Parameters
+        ----------
+        obj : module or function
+            The module or function to compile the quasiquotes of.
+        quasiquoters : iterable[str], optional
+            The names that this quasiquoter is bound to in the source.
+            Defaults to the global names bound to this quasiquoter in the
+            module that ``obj`` is defined in.
+        processes : int, optional
+            The number of compilers to run at once. Defaults to the number
+            of cpus.
+
+        Returns
+        -------
+        compiled : list[str]
+            The paths to the shared objects that were compiled. Shared
+            objects are only listed when ``keep_so`` is True.
+
+        Notes
+        -----
+        The compiled functions are held by the quasiquoter and handed to the
+        quasiquotes the first time they run, so that first run neither runs
+        the compiler nor loads a shared object. If this quasiquoter was
+        constructed with ``batch=True`` then the batches for the whole source
+        file are built.
+        """
+        if ismodule(obj):
+            ns = vars(obj)
+            lines = None
+        else:
+            ns = obj.__globals__
+            lines = range(
+                obj.__code__.co_firstlineno,
+                _last_line(obj.__code__) + 1,
+            )
+
+        if quasiquoters is None:
+            quasiquoters = {name for name, ob in ns.items() if ob is self}
+        quasiquoters = frozenset(quasiquoters)
+
+        filename = getsourcefile(obj)
+        jobs = await get_event_loop().run_in_executor(
+            None,
+            self._warm_jobs,
+            filename,
+            quasiquoters,
+            lines,
+        )
+        semaphore = Semaphore(processes or os.cpu_count() or 1)
+        if self._batch:
+            compiled = await gather(*(
+                self._warm_batch_async(semaphore, batch, filename)
+                for batch in jobs
+            ))
+            self._batched_files.add(filename)
+        else:
+            compiled = await gather(*(
+                self._warm_async(semaphore, key, filename, *job)
+                for key, job in jobs.items()
+            ))
+        return [soname for soname in compiled if soname is not None]
+
+    def _warm_jobs(self, filename, quasiquoters, lines):
+        """Find the functions for ``precompile_async`` to build. This reads
+        and analyzes the whole source file, so it is run in an executor.
+
+        Parameters
+        ----------
+        filename : str
+            The python source file.
+        quasiquoters : frozenset[str]
+            The names that this quasiquoter is bound to in the source.
+        lines : range or None
+            The lines to build the quasiquotes of, or None for all of them.
+
+        Returns
+        -------
+        jobs : list[dict] or dict
+            When batching, the jobs for each batch, otherwise the jobs for
+            each function. See ``_batch_jobs``.
+        """
+        with open(filename, 'rb') as f:
+            source = f.read()
+
+        sites = [
+            site for site in quote_sites(source.decode('utf-8'), filename)
+            if site.name in quasiquoters
+        ]
+        if self._batch:
+            return [
+                self._batch_jobs(s for s in sites if s.name == name)
+                for name in {site.name for site in sites}
+            ]
+
+        jobs = {}
+        for site in sites:
+            if lines is not None and site.lineno not in lines:
+                continue
+            names = free_names(site.code, site.scope)
+            jobs.setdefault(
+                self._key(site.code, site.kind, names),
+                (site.code, site.kind, names, site.lineno),
+            )
+        return jobs
+
+    async def _warm_async(self,
+                          semaphore,
+                          key,
+                          filename,
+                          code,
+                          kind,
+                          names,
+                          lineno):
+        loop = get_event_loop()
+        soname = None
+        try:
+            f = await loop.run_in_executor(
+                None,
+                self._load,
+                code,
+                kind,
+                names,
+                filename,
+            )
+        except OSError:
+            dirname, basename = self._dir_and_basename(
+                code,
+                filename,
+                kind,
+                names,
+            )
+            async with semaphore:
+                soname = await self._build_source_async(
+                    self._source(code, kind, names, filename, lineno),
+                    dirname,
+                    basename,
+                    stale=_stat(os.path.join(dirname, basename) + '.so'),
+                )
+            f = await loop.run_in_executor(None, create_callable, soname)
+            if not self._keep_so:
+                os.remove(soname)
+                soname = None
+
+        with self._lru_lock:
+            warm = self._warm
+            warm[key] = f
+            # functions whose quasiquote never runs are dropped eventually
+            while self._cache_size is not None and (
+                    len(warm) > self._cache_size):
+                warm.popitem(last=False)
+        return soname
+
+    async def _warm_batch_async(self, semaphore, jobs, filename):
+        if not jobs:
+            return None
+
+        dirname, basename = self._batch_dir_and_basename(jobs, filename)
+        path = os.path.join(dirname, basename) + '.so'
+        loop = get_event_loop()
+        soname = None
+        try:
+            fs = await loop.run_in_executor(None, create_callables, path)
+        except OSError:
+            async with semaphore:
+                soname = await self._build_source_async(
+                    self._batch_source(jobs, filename),
+                    dirname,
+                    basename,
+                    stale=_stat(path),
+                )
+            fs = await loop.run_in_executor(None, create_callables, soname)
+            if not self._keep_so:
+                os.remove(soname)
+                soname = None
+
+        self._by_key.update(fs)
+        self._batch_keys[filename] = (
+            self._batch_keys.get(filename, ()) + tuple(fs)
+        )
+        return soname
+
+
+def _stat(path):
+    """The status of a file, or None if it does not exist.
+    """
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _is_built(soname, stale):
+    """Is there a shared object at ``soname`` other than ``stale``?
+    """
+    status = _stat(soname)
+    return status is not None and (
+        stale is None or not os.path.samestat(status, stale)
+    )
+
+
+def _last_line(code):
+    """The last line of source that a code object or any of the code objects
+    nested in it were compiled from.
+    """
+    return max(
+        [lineno for _, lineno in findlinestarts(code)] +
+        [_last_line(const) for const in code.co_consts if iscode(const)]
+    )
+
+
+def _precompile(kwargs, code, kind, names, filename, lineno):
+    return c(**kwargs)._build(code, kind, names, filename, lineno)
+
+
+def _precompile_batch(kwargs, jobs, filename):
+    return c(**kwargs)._build_batch(jobs, filename)
 
 
 def load_ipython_extension(ipython):
@@ -464,19 +1932,24 @@ def load_ipython_extension(ipython):
     qq = c(keep_c=False, keep_so=False)
 
     def c(line, cell=None):
-        ns = ipython.user_ns  # noqa
+        ns = ipython.user_ns
+        scope = set(ns) | set(builtins_ns)
         frame = sys._getframe()
         if cell is None:
             lineno = frame.f_lineno + 1
-            ret = qq._resolve_expr(line, frame, 0)(ns, ns)
+            ret = qq._resolve_expr(line, frame, 0, scope)[0](
+                builtins_ns,
+                ns,
+                ns,
+            )
             cache = qq._expr_cache
         else:
             ret = None
             cache = qq._stmt_cache
             lineno = frame.f_lineno + 1
-            qq._resolve_stmt(cell, frame, 0)(ns, ns)
+            qq._resolve_stmt(cell, frame, 0, scope)[0](builtins_ns, ns, ns)
 
-        del cache[frame.f_code, lineno, 0]
+        del cache[frame.f_code][lineno, 0]
         return ret
 
     ipython.register_magic_function(c, 'line_cell', 'c')
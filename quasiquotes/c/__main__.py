@@ -8,17 +8,54 @@ def main():
     parser.add_argument(
         '--path',
         default='.',
-        help='The path to run c.cleanup on',
+        help='The path to run c.cleanup or c.precompile on',
     )
     parser.add_argument(
         '--no-recurse',
         action='store_false',
         dest='recurse',
         default=True,
-        help='Should cleanup recurse down from PATH?',
+        help='Should cleanup or precompile recurse down from PATH?',
     )
-    for removed in c.cleanup(**vars(parser.parse_args())):
-        print(removed)
+    parser.add_argument(
+        '--precompile',
+        action='store_true',
+        default=False,
+        help='Compile all of the quoted c code in PATH instead of removing'
+        ' the cached shared objects',
+    )
+    parser.add_argument(
+        '--quasiquoter',
+        action='append',
+        dest='quasiquoters',
+        help='A name that the c quasiquoter is bound to, defaults to c.'
+        ' This may be passed more than once.',
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help='The directory to cache the compiled shared objects in',
+    )
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        help='The number of compilers to run at once, defaults to the number'
+        ' of cpus',
+    )
+    args = parser.parse_args()
+
+    if args.precompile:
+        paths = c(cache_dir=args.cache_dir).precompile(
+            path=args.path,
+            recurse=args.recurse,
+            quasiquoters=args.quasiquoters or ('c',),
+            processes=args.jobs,
+        )
+    else:
+        paths = c.cleanup(path=args.path, recurse=args.recurse)
+
+    for path in paths:
+        print(path)
 
 
 main()
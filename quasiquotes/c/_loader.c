@@ -1,13 +1,68 @@
 #include <Python.h>
 #include <dlfcn.h>
 
+static const char *handle_name = "quasiquotes.c._loader.handle";
+
+static void
+close_handle(PyObject *capsule)
+{
+    void *sohandle = PyCapsule_GetPointer(capsule, handle_name);
+
+    if (sohandle) {
+        dlclose(sohandle);
+    }
+}
+
+/* Open a shared object. The handle is owned by a capsule which is used as the
+   ``self`` of every function created from the shared object so that it is
+   closed when the last of them is deallocated. */
+static PyObject *
+open_handle(const char *filename)
+{
+    void *sohandle;
+    PyObject *capsule;
+
+    if (!(sohandle = dlopen(filename, RTLD_LAZY))) {
+        PyErr_SetString(PyExc_OSError, dlerror());
+        return NULL;
+    }
+    if (!(capsule = PyCapsule_New(sohandle, handle_name, close_handle))) {
+        dlclose(sohandle);
+        return NULL;
+    }
+    return capsule;
+}
+
+static void *
+lookup(PyObject *capsule, const char *symbol)
+{
+    void *p = dlsym(PyCapsule_GetPointer(capsule, handle_name), symbol);
+
+    if (!p) {
+        PyErr_SetString(PyExc_OSError, dlerror());
+    }
+    return p;
+}
+
+/* intern the names that the functions read from the python scope */
+static int
+init_names(PyObject *capsule)
+{
+    int (*qq_init)(void) = (int (*)(void)) dlsym(
+        PyCapsule_GetPointer(capsule, handle_name),
+        "__qq_init");
+
+    return qq_init && qq_init();
+}
+
 static PyObject *
 create_callable(PyObject *self, PyObject *args, PyObject *kwargs)
 {
     char* keywords[] = {"filename", NULL};
     char *filename;
-    void *sohandle;
+    PyObject *capsule;
     PyMethodDef *qq_methoddef;
+    PyObject *f;
 
     if (!(PyArg_ParseTupleAndKeywords(args,
                                       kwargs,
@@ -17,15 +72,71 @@ create_callable(PyObject *self, PyObject *args, PyObject *kwargs)
         return NULL;
     }
 
-    if (!(sohandle = dlopen(filename, RTLD_LAZY))) {
-        PyErr_SetString(PyExc_OSError, dlerror());
+    if (!(capsule = open_handle(filename))) {
         return NULL;
     }
-    if (!(qq_methoddef = dlsym(sohandle, "__qq_methoddef"))) {
-        PyErr_SetString(PyExc_OSError, dlerror());
+    if (!(qq_methoddef = lookup(capsule, "__qq_methoddef")) ||
+        init_names(capsule)) {
+        Py_DECREF(capsule);
+        return NULL;
+    }
+    f = PyCFunction_NewEx(qq_methoddef, capsule, NULL);
+    Py_DECREF(capsule);
+    return f;
+}
+
+static PyObject *
+create_callables(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    char* keywords[] = {"filename", NULL};
+    char *filename;
+    PyObject *capsule;
+    PyMethodDef **qq_methoddefs;
+    const char **qq_keys;
+    PyObject *out;
+    PyObject *f;
+    Py_ssize_t n;
+
+    if (!(PyArg_ParseTupleAndKeywords(args,
+                                      kwargs,
+                                      "s:create_callables",
+                                      keywords,
+                                      &filename))) {
+        return NULL;
+    }
+
+    if (!(capsule = open_handle(filename))) {
+        return NULL;
+    }
+    if (!(qq_methoddefs = lookup(capsule, "__qq_methoddefs")) ||
+        !(qq_keys = lookup(capsule, "__qq_keys")) ||
+        init_names(capsule)) {
+        Py_DECREF(capsule);
+        return NULL;
+    }
+
+    if (!(out = PyDict_New())) {
+        Py_DECREF(capsule);
         return NULL;
     }
-    return PyCFunction_NewEx(qq_methoddef, NULL, NULL);
+    /* every function shares the handle, the shared object is closed once
+       all of them have been deallocated */
+    for (n = 0; qq_methoddefs[n]; ++n) {
+        if (!(f = PyCFunction_NewEx(qq_methoddefs[n], capsule, NULL))) {
+            Py_DECREF(capsule);
+            Py_DECREF(out);
+            return NULL;
+        }
+        if (PyDict_SetItemString(out, qq_keys[n], f)) {
+            Py_DECREF(f);
+            Py_DECREF(capsule);
+            Py_DECREF(out);
+            return NULL;
+        }
+        Py_DECREF(f);
+    }
+    Py_DECREF(capsule);
+    return out;
 }
 
 static PyMethodDef methods[] = {
@@ -33,6 +144,10 @@ static PyMethodDef methods[] = {
      (PyCFunction) create_callable,
      METH_VARARGS | METH_KEYWORDS,
      ""},
+    {"create_callables",
+     (PyCFunction) create_callables,
+     METH_VARARGS | METH_KEYWORDS,
+     ""},
     {NULL},
 };
 
@@ -0,0 +1,340 @@
+from asyncio import get_event_loop
+from ctypes import CDLL, CFUNCTYPE, c_char_p, c_int, c_void_p
+from ctypes.util import find_library
+from distutils.sysconfig import get_python_inc
+import os
+from tempfile import mkstemp
+from threading import Lock
+
+from ..utils.cache import publish
+from ..utils.lock import file_lock
+from ..utils.shell import Executable, Flag
+
+
+class Compiler:
+    """A backend which compiles generated C source into a shared object.
+    """
+    def fingerprint(self, extra_compile_args):
+        """A string identifying everything about this compiler that affects
+        the shared objects it produces.
+
+        Parameters
+        ----------
+        extra_compile_args : iterable[str or Flag]
+            The extra arguments that will be passed to ``compile``.
+
+        Returns
+        -------
+        fingerprint : str
+            The string to include in the cache key.
+        """
+        raise NotImplementedError('fingerprint')
+
+    def compile(self, cname, soname, extra_compile_args):
+        """Compile a C source file into a shared object.
+
+        Parameters
+        ----------
+        cname : str
+            The path to the C source.
+        soname : str
+            The path to write the shared object to.
+        extra_compile_args : iterable[str or Flag]
+            Extra arguments for the compiler.
+
+        Returns
+        -------
+        err : str
+            The diagnostics emitted by the compiler.
+        status : int
+            Nonzero if the compilation failed.
+        """
+        raise NotImplementedError('compile')
+
+    def precompile_header(self, header, source, extra_compile_args):
+        """Compile a header so that later compiles may include it without
+        parsing it again.
+
+        Parameters
+        ----------
+        header : str
+            The path to write the header to. Compilers that do not use the
+            header should not write it.
+        source : str
+            The contents of the header.
+        extra_compile_args : iterable[str or Flag]
+            The extra arguments that will be passed to ``compile``.
+
+        Returns
+        -------
+        args : tuple[str or Flag]
+            The arguments to add to ``extra_compile_args`` to include the
+            precompiled header. This is empty if the compiler does not
+            support precompiled headers.
+        """
+        return ()
+
+    async def compile_async(self, cname, soname, extra_compile_args):
+        """Compile a C source file into a shared object without blocking the
+        event loop. See ``compile``.
+
+        By default ``compile`` is run in the event loop's default executor.
+        """
+        return await get_event_loop().run_in_executor(
+            None,
+            self.compile,
+            cname,
+            soname,
+            extra_compile_args,
+        )
+
+
+class GCC(Compiler):
+    """Compile with gcc in a subprocess.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the gcc executable.
+    optimize : int, optional
+        The optimization level.
+    precompiled_header : bool, optional
+        Build ``.gch`` precompiled headers when asked to. Defaults to True.
+    """
+    def __init__(self, name='gcc', optimize=3, precompiled_header=True):
+        self.executable = Executable(name)
+        self.optimize = optimize
+        self.precompiled_header = precompiled_header
+
+    def __repr__(self):
+        return '{cls}({name!r}, optimize={optimize})'.format(
+            cls=type(self).__name__,
+            name=self.executable._name,
+            optimize=self.optimize,
+        )
+
+    def flags(self):
+        return (
+            Flag.O(self.optimize),
+            Flag.I(get_python_inc()),
+            Flag.f('PIC'),
+            Flag.std('gnu11'),
+            Flag.shared,
+        )
+
+    def fingerprint(self, extra_compile_args):
+        return ' '.join(map(str, (
+            (self.executable.path,) +
+            self.flags() +
+            tuple(extra_compile_args)
+        )))
+
+    def compile(self, cname, soname, extra_compile_args):
+        result = self.executable(
+            *self.flags() + (
+                Flag.o(soname),
+                cname,
+            ) + tuple(extra_compile_args)
+        )
+        return result.err, result.returncode
+
+    def precompile_header(self, header, source, extra_compile_args):
+        if not self.precompiled_header:
+            return ()
+
+        dirname = os.path.dirname(header)
+        gch = header + '.gch'
+        lockname = header + '.lock'
+        # the lock file is left in place, see ``c._build_source``
+        with file_lock(lockname):
+            if not os.path.exists(header):
+                fd, tmp_header = mkstemp(
+                    prefix='_qq_tmp_',
+                    suffix='.h',
+                    dir=dirname,
+                )
+                with open(fd, 'w') as f:
+                    f.write(source)
+                publish(tmp_header, header)
+
+            if not os.path.exists(gch):
+                # gcc only uses the precompiled header if it was built with
+                # the same flags as the code that includes it
+                fd, tmp_gch = mkstemp(
+                    prefix='_qq_tmp_',
+                    suffix='.gch',
+                    dir=dirname,
+                )
+                os.close(fd)
+                result = self.executable(
+                    *self.flags() + tuple(extra_compile_args) + (
+                        Flag.o(tmp_gch),
+                        Flag.x('c-header'),
+                        header,
+                    )
+                )
+                if result.returncode:
+                    os.remove(tmp_gch)
+                    return ()
+                publish(tmp_gch, gch)
+
+        return Flag.include, header
+
+    async def compile_async(self, cname, soname, extra_compile_args):
+        result = await self.executable.call_async(
+            *self.flags() + (
+                Flag.o(soname),
+                cname,
+            ) + tuple(extra_compile_args)
+        )
+        return result.err, result.returncode
+
+
+class TCC(Compiler):
+    """Compile in process with libtcc.
+
+    tcc compiles orders of magnitude faster than gcc but does not optimize,
+    which makes it a good fit for development and tests.
+
+    Parameters
+    ----------
+    library : str, optional
+        The path to ``libtcc.so``. By default this is searched for with
+        :func:`ctypes.util.find_library`.
+    lib_path : str, optional
+        The tcc library directory which holds ``libtcc1.a`` and tcc's own
+        headers. By default the path libtcc was built with is used.
+    dll_output_type : int, optional
+        The value of ``TCC_OUTPUT_DLL`` in the ``libtcc.h`` that ``library``
+        was built from. This is 3 for tcc 0.9.27 and 4 for newer releases.
+
+    Raises
+    ------
+    OSError
+        Raised when libtcc cannot be found.
+    """
+    _error_func = CFUNCTYPE(None, c_void_p, c_char_p)
+
+    # libtcc keeps global state, only one compilation may run at a time
+    _lock = Lock()
+
+    def __init__(self, library=None, lib_path=None, dll_output_type=3):
+        if library is None:
+            library = find_library('tcc')
+            if library is None:
+                raise OSError('could not find libtcc')
+
+        self.library = library
+        self.lib_path = lib_path
+        self.dll_output_type = dll_output_type
+        self._lib = lib = CDLL(library)
+        lib.tcc_new.restype = c_void_p
+        lib.tcc_new.argtypes = ()
+        lib.tcc_delete.restype = None
+        lib.tcc_delete.argtypes = (c_void_p,)
+        lib.tcc_set_error_func.restype = None
+        lib.tcc_set_error_func.argtypes = (
+            c_void_p,
+            c_void_p,
+            self._error_func,
+        )
+        lib.tcc_set_lib_path.restype = None
+        lib.tcc_set_lib_path.argtypes = (c_void_p, c_char_p)
+        for name in ('tcc_add_include_path',
+                     'tcc_add_file',
+                     'tcc_output_file'):
+            f = getattr(lib, name)
+            f.restype = c_int
+            f.argtypes = (c_void_p, c_char_p)
+        # the return type changed between tcc versions, ignore it
+        lib.tcc_set_options.restype = None
+        lib.tcc_set_options.argtypes = (c_void_p, c_char_p)
+        lib.tcc_set_output_type.restype = c_int
+        lib.tcc_set_output_type.argtypes = (c_void_p, c_int)
+
+    def __repr__(self):
+        return '{cls}({library!r}, lib_path={lib_path!r})'.format(
+            cls=type(self).__name__,
+            library=self.library,
+            lib_path=self.lib_path,
+        )
+
+    def __reduce__(self):
+        return type(self), (
+            self.library,
+            self.lib_path,
+            self.dll_output_type,
+        )
+
+    def fingerprint(self, extra_compile_args):
+        return ' '.join(map(str, (
+            (self.library, self.lib_path, get_python_inc()) +
+            tuple(extra_compile_args)
+        )))
+
+    def compile(self, cname, soname, extra_compile_args):
+        lib = self._lib
+        errors = []
+
+        @self._error_func
+        def on_error(opaque, msg):
+            errors.append(msg.decode('utf-8', 'replace'))
+
+        with self._lock:
+            state = lib.tcc_new()
+            if not state:
+                raise MemoryError('failed to create a tcc state')
+            try:
+                lib.tcc_set_error_func(state, None, on_error)
+                if self.lib_path is not None:
+                    lib.tcc_set_lib_path(state, self.lib_path.encode())
+                extra = ' '.join(map(str, extra_compile_args))
+                if extra:
+                    lib.tcc_set_options(state, extra.encode())
+                status = (
+                    lib.tcc_set_output_type(state, self.dll_output_type) or
+                    lib.tcc_add_include_path(
+                        state,
+                        get_python_inc().encode(),
+                    ) or
+                    lib.tcc_add_file(state, cname.encode()) or
+                    lib.tcc_output_file(state, soname.encode())
+                )
+            finally:
+                lib.tcc_delete(state)
+
+        return '\n'.join(errors), int(bool(status))
+
+
+_compilers = {
+    'gcc': GCC,
+    'tcc': TCC,
+}
+
+
+def get_compiler(compiler):
+    """Look up a compiler backend.
+
+    Parameters
+    ----------
+    compiler : str or Compiler
+        Either the name of a compiler, 'gcc' or 'tcc', or a ``Compiler``
+        instance.
+
+    Returns
+    -------
+    compiler : Compiler
+        The compiler backend.
+    """
+    if isinstance(compiler, Compiler):
+        return compiler
+
+    try:
+        return _compilers[compiler]()
+    except KeyError:
+        raise ValueError(
+            'unknown compiler {!r}, must be one of: {}'.format(
+                compiler,
+                ', '.join(sorted(_compilers)),
+            ),
+        )
@@ -0,0 +1,317 @@
+import re
+
+
+keywords = frozenset({
+    '_Alignas',
+    '_Alignof',
+    '_Atomic',
+    '_Bool',
+    '_Complex',
+    '_Generic',
+    '_Imaginary',
+    '_Noreturn',
+    '_Static_assert',
+    '_Thread_local',
+    '__asm__',
+    '__attribute__',
+    '__extension__',
+    '__inline__',
+    '__typeof__',
+    'asm',
+    'auto',
+    'break',
+    'case',
+    'char',
+    'const',
+    'continue',
+    'default',
+    'do',
+    'double',
+    'else',
+    'enum',
+    'extern',
+    'float',
+    'for',
+    'goto',
+    'if',
+    'inline',
+    'int',
+    'long',
+    'register',
+    'restrict',
+    'return',
+    'short',
+    'signed',
+    'sizeof',
+    'static',
+    'struct',
+    'switch',
+    'typedef',
+    'typeof',
+    'union',
+    'unsigned',
+    'void',
+    'volatile',
+    'while',
+})
+
+
+_token_pattern = re.compile(
+    r"""
+    (?P<comment>/\*.*?\*/|//[^\n]*)
+    |(?P<directive>^[ \t]*\#(?:\\\n|[^\n])*)
+    |(?P<string>"(?:\\.|[^"\\\n])*")
+    |(?P<char>'(?:\\.|[^'\\\n])*')
+    |(?P<name>[A-Za-z_]\w*)
+    |(?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+    |(?P<op><<=|>>=|->|\+\+|--|&&|\|\||<<|>>|[-+*/%&|^=!<>]=|\S)
+    """,
+    re.VERBOSE | re.MULTILINE | re.DOTALL,
+)
+_ignored = frozenset({'comment', 'directive'})
+
+
+def tokenize(code):
+    """Split C source into tokens.
+
+    Comments and preprocessor directives are dropped.
+
+    Parameters
+    ----------
+    code : str
+        The C source to tokenize.
+
+    Yields
+    ------
+    kind : {'string', 'char', 'name', 'number', 'op'}
+        The type of the token.
+    text : str
+        The source text of the token.
+    """
+    for match in _token_pattern.finditer(code):
+        kind = match.lastgroup
+        if kind not in _ignored:
+            yield kind, match.group()
+
+
+# Names that follow these tokens are never variables.
+_not_variable_prefix = frozenset({
+    '.',
+    '->',
+    'enum',
+    'goto',
+    'struct',
+    'union',
+})
+
+
+# Type specifiers which may start a declaration.
+_type_keywords = frozenset({
+    '_Bool',
+    '_Complex',
+    'char',
+    'double',
+    'float',
+    'int',
+    'long',
+    'short',
+    'signed',
+    'unsigned',
+    'void',
+})
+# Tokens which may appear between the type and the name in a declaration.
+_declarator_prefix = frozenset({
+    '*',
+    '_Atomic',
+    'auto',
+    'const',
+    'extern',
+    'register',
+    'restrict',
+    'static',
+    'volatile',
+})
+# Tokens which may follow the name in a declaration.
+_declarator_suffix = frozenset({';', ',', '=', '['})
+_open = frozenset({'(', '[', '{'})
+_close = frozenset({')', ']', '}'})
+
+
+def _skip_back(toks, n, skip):
+    """Find the index of the last token before ``n`` that is not in ``skip``.
+    Returns -1 if there is no such token.
+    """
+    n -= 1
+    while n >= 0 and toks[n][1] in skip:
+        n -= 1
+    return n
+
+
+def _starts_statement(toks, n):
+    """Does the token at index ``n`` start a statement or a ``for`` loop's
+    initializer?
+    """
+    if n < 0 or toks[n][1] in ('{', '}', ';'):
+        return True
+    return toks[n][1] == '(' and n > 0 and toks[n - 1][1] == 'for'
+
+
+def declared_names(code):
+    """Find the names that a block of C code declares as variables.
+
+    Parameters
+    ----------
+    code : str
+        The C source of the quoted block.
+
+    Returns
+    -------
+    names : frozenset[str]
+        The names declared in ``code``.
+
+    Notes
+    -----
+    This recognizes declarations which start with a type keyword, like
+    ``long i;``, or with a type name at the start of a statement, like
+    ``PyObject *a = NULL, *b;``. A statement like ``a * b;`` is treated as a
+    declaration of ``b``.
+    """
+    toks = list(tokenize(code))
+    declared = set()
+    depth = 0
+    # the nesting depth of the declaration being parsed, if any
+    decl_depth = None
+    for n, (kind, text) in enumerate(toks):
+        if text in _open:
+            depth += 1
+        elif text in _close:
+            depth -= 1
+            if decl_depth is not None and depth < decl_depth:
+                decl_depth = None
+        elif text == ';' and depth == decl_depth:
+            decl_depth = None
+
+        if (kind != 'name' or
+                text in keywords or
+                toks[n + 1:n + 2] == [] or
+                toks[n + 1][1] not in _declarator_suffix):
+            continue
+
+        p = _skip_back(toks, n, _declarator_prefix)
+        if p < 0:
+            continue
+
+        prev_kind, prev = toks[p]
+        if prev in _type_keywords:
+            is_declarator = True
+        elif prev == ',':
+            is_declarator = depth == decl_depth
+        elif prev_kind == 'name' and prev not in keywords:
+            start = _skip_back(toks, p, _declarator_prefix)
+            is_declarator = (
+                _starts_statement(toks, start) or
+                toks[start][1] in ('struct', 'union', 'enum')
+            )
+        else:
+            is_declarator = False
+
+        if is_declarator:
+            declared.add(text)
+            decl_depth = depth
+
+    return frozenset(declared)
+
+
+def free_names(code, scope):
+    """Find the names in a block of C code that should be read from the
+    enclosing python scope.
+
+    Parameters
+    ----------
+    code : str
+        The C source of the quoted block.
+    scope : container[str]
+        The names that are visible in the python scope.
+
+    Returns
+    -------
+    names : tuple[str]
+        The names referenced as variables in ``code`` that are visible in
+        ``scope`` in order of first use.
+
+    Notes
+    -----
+    Names that are used as functions, struct members, tags, or labels are
+    never captured. Names declared in the quoted block are never captured,
+    even where they shadow a python name, see ``declared_names``.
+    """
+    names = []
+    seen = set(declared_names(code))
+    prev = None
+    toks = list(tokenize(code))
+    for n, (kind, text) in enumerate(toks):
+        if (kind == 'name' and
+                text not in seen and
+                text in scope and
+                text not in keywords and
+                prev not in _not_variable_prefix and
+                toks[n + 1:n + 2] != [('op', '(')]):
+            seen.add(text)
+            names.append(text)
+        prev = text
+    return tuple(names)
+
+
+_assignment_ops = frozenset({
+    '=',
+    '+=',
+    '-=',
+    '*=',
+    '/=',
+    '%=',
+    '&=',
+    '|=',
+    '^=',
+    '<<=',
+    '>>=',
+})
+# Names that follow these tokens may be written to.
+_write_prefix = frozenset({'++', '--', '&'})
+
+
+def assigned_names(code, names):
+    """Find the names in a block of C code which may be written to.
+
+    Parameters
+    ----------
+    code : str
+        The C source of the quoted block.
+    names : iterable[str]
+        The names captured from the python scope.
+
+    Returns
+    -------
+    assigned : tuple[str]
+        The subset of ``names`` that are assigned to, incremented,
+        decremented, or have their address taken in ``code``, in the order of
+        ``names``.
+
+    Notes
+    -----
+    This is conservative: a name that is used as the right hand side of a
+    binary ``&`` is treated as written.
+    """
+    names = tuple(names)
+    candidates = set(names)
+    assigned = set()
+    prev = None
+    toks = list(tokenize(code))
+    for n, (kind, text) in enumerate(toks):
+        if kind == 'name' and text in candidates and prev not in ('.', '->'):
+            next_ = toks[n + 1][1] if n + 1 < len(toks) else None
+            if (prev in _write_prefix or
+                    next_ in _assignment_ops or
+                    next_ in ('++', '--')):
+                assigned.add(text)
+        prev = text
+    return tuple(name for name in names if name in assigned)
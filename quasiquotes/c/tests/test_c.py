@@ -1,14 +1,26 @@
 # coding: quasiquotes
 
+import asyncio
+import os
+from threading import Barrier, Thread, current_thread
+
 import pytest
 
+import quasiquotes.c as c_module
 from quasiquotes.c import c
+from quasiquotes.c.compilers import GCC, TCC
+from quasiquotes.utils.cache import _umask
 
 
 qq = c(keep_c=False, keep_so=False)  # no caching
 globalvar = 'globalvar'  # global lookup for checking scope resolution
 
 
+def no_locks(path):
+    # the lock files used to build each file once are left in the cache
+    return path.ext != '.lock'
+
+
 def test_local_lookup_stmt():
     localvar = 'localvar'
     out = [None]
@@ -36,6 +48,45 @@ def test_local_reassign():
     assert localvar == 'updated'
 
 
+def test_declared_local_stmt():
+    # ``i`` and ``result`` are also python locals, bound after the block
+    def f():
+        with $qq:
+            long i;
+            PyObject *result;
+            i = 2;
+            result = PyLong_FromLong(i);
+            Py_DECREF(result);
+        i = result = None
+        return i, result
+
+    assert f() == (None, None)
+
+
+def test_declared_local_expr():
+    def f():
+        out = [$qq|({ long result = 3; PyLong_FromLong(result); })|]
+        result = None
+        return out, result
+
+    assert f() == (3, None)
+
+
+def test_read_only_stmt_skips_locals_to_fast(monkeypatch):
+    def locals_to_fast(frame):
+        raise AssertionError('locals_to_fast called for a read-only block')
+
+    monkeypatch.setattr(qq, 'locals_to_fast', locals_to_fast)
+    localvar = 'localvar'
+    out = [None]
+
+    with $qq:
+        Py_INCREF(localvar);
+        PyList_SetItem(out, 0, localvar);
+
+    assert out[0] is localvar
+
+
 def test_global_lookup_stmt():
     out = [None]
 
@@ -109,3 +160,428 @@ def test_globals_over_builtins_expr(patch_id):
     result = [$qq|Py_INCREF(id); id|]
     assert result is patch_id
     assert result == 'globalvar'
+
+
+def test_extra_compile_args_split():
+    # the compiler is run without a shell, the strings are split for it
+    qq_args = c(keep_so=False, extra_compile_args=['-O0 -DQQ_ONE=1'])
+    assert [$qq_args|PyLong_FromLong(QQ_ONE)|] == 1
+
+
+def test_cache_dir(tmpdir):
+    def one(qq):
+        return [$qq|PyLong_FromLong(1)|]
+
+    assert one(c(cache_dir=str(tmpdir))) == 1
+    sos = tmpdir.join('c').listdir(no_locks)
+    assert len(sos) == 1
+    assert sos[0].ext == '.so'
+
+    # a new quasiquoter sharing the cache loads the existing shared object
+    assert one(c(cache_dir=str(tmpdir))) == 1
+    assert tmpdir.join('c').listdir(no_locks) == sos
+
+
+def test_cache_dir_special_characters(tmpdir):
+    def one(qq):
+        return [$qq|PyLong_FromLong(1)|]
+
+    # the compiler is run without a shell, so the paths need no quoting
+    cache_dir = tmpdir.join("it's $HOME (cache)")
+    assert one(c(cache_dir=str(cache_dir))) == 1
+    assert len(cache_dir.join('c').listdir(no_locks)) == 1
+
+
+def test_rebuild_unloadable(tmpdir):
+    def one(qq):
+        return [$qq|PyLong_FromLong(1)|]
+
+    assert one(c(cache_dir=str(tmpdir))) == 1
+    (so,) = tmpdir.join('c').listdir('*.so')
+    size = so.size()
+
+    # a truncated shared object is rebuilt instead of failing to load
+    so.write_binary(so.read_binary()[:64])
+    assert one(c(cache_dir=str(tmpdir))) == 1
+    assert so.size() == size
+
+    # processes may still be waiting on the lock file, so it is kept
+    assert len(tmpdir.join('c').listdir('*.lock')) == 1
+
+
+def test_cleanup(tmpdir):
+    generated = [
+        tmpdir.join('_qq_stmt_abc.so'),
+        tmpdir.join('_qq_stmt_abc.lock'),
+        tmpdir.join('_qq_header_abc.h.gch'),
+    ]
+    # only the file names are matched, not the directories they are in
+    kept = tmpdir.join('_qq_project').join('header.h')
+    for path in generated + [kept]:
+        path.ensure()
+
+    removed = c.cleanup(str(tmpdir))
+    assert sorted(removed) == sorted(map(str, generated))
+    assert kept.check()
+
+
+def test_precompiled_header(tmpdir):
+    def one(qq):
+        return [$qq|PyLong_FromLong(1)|]
+
+    def two(qq):
+        return [$qq|PyLong_FromLong(2)|]
+
+    assert one(c(cache_dir=str(tmpdir))) == 1
+    header, gch = sorted(map(str, tmpdir.join('pch').listdir(no_locks)))
+    assert gch == header + '.gch'
+    mtime = os.path.getmtime(gch)
+
+    # the header is shared by every quasiquoter with the same flags
+    assert two(c(cache_dir=str(tmpdir))) == 2
+    assert os.path.getmtime(gch) == mtime
+    assert len(tmpdir.join('pch').listdir(no_locks)) == 2
+
+    # different flags need a different precompiled header
+    assert one(c(cache_dir=str(tmpdir), compiler=GCC(optimize=0))) == 1
+    assert len(tmpdir.join('pch').listdir(no_locks)) == 4
+
+    # the cache may be shared with other users
+    for path in tmpdir.join('pch').listdir(no_locks):
+        assert path.stat().mode & 0o777 == 0o666 & ~_umask
+
+    # nothing is written for a compiler that does not use the header
+    unused = tmpdir.join('unused')
+    compiler = GCC(optimize=1, precompiled_header=False)
+    assert one(c(cache_dir=str(unused), compiler=compiler)) == 1
+    assert not unused.join('pch').listdir()
+
+
+def test_precompile(tmpdir, monkeypatch, write_module, load_module):
+    monkeypatch.setenv('QUASIQUOTES_CACHE_DIR', str(tmpdir.join('cache')))
+    source = write_module(
+        tmpdir,
+        'mod',
+        """\
+        # coding: quasiquotes
+        from quasiquotes.c import c
+
+        def f(a):
+            return [$c|Py_INCREF(a); a|]
+
+        def g():
+            with $c:
+                Py_None;
+        """,
+    )
+
+    compiled = c.precompile(str(tmpdir))
+    assert len(compiled) == 2
+    sos = sorted(map(str, tmpdir.join('cache', 'c').listdir(no_locks)))
+    assert sos == sorted(compiled)
+
+    mod = load_module(source)
+    ob = object()
+    assert mod.f(ob) is ob
+    mod.g()
+
+    # the runtime used the precompiled shared objects
+    assert sorted(map(str, tmpdir.join('cache', 'c').listdir(no_locks))) == sos
+    assert c.precompile(str(tmpdir)) == []
+
+
+def test_precompile_async(tmpdir, write_module, load_module):
+    mod = load_module(write_module(
+        tmpdir,
+        'warm',
+        """\
+        # coding: quasiquotes
+        from quasiquotes.c import c
+
+        qq = c(cache_dir={cache_dir!r})
+
+        def f(a):
+            return [$qq|Py_INCREF(a); a|]
+
+        def g():
+            with $qq:
+                Py_None;
+        """,
+        cache_dir=str(tmpdir.join('cache')),
+    ))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        compiled = loop.run_until_complete(mod.qq.precompile_async(mod.f))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    # only the quasiquote in ``f`` was compiled
+    assert len(compiled) == 1
+    sos = tmpdir.join('cache', 'c').listdir(no_locks)
+    assert list(map(str, sos)) == compiled
+    assert len(mod.qq._warm) == 1
+
+    ob = object()
+    assert mod.f(ob) is ob
+    assert mod.qq._warm == {}
+    mod.g()
+
+
+def test_precompile_async_off_loop(tmpdir,
+                                   monkeypatch,
+                                   write_module,
+                                   load_module):
+    mod = load_module(write_module(
+        tmpdir,
+        'warm_bounded',
+        """\
+        # coding: quasiquotes
+        from quasiquotes.c import c
+
+        qq = c(cache_size=1, cache_dir={cache_dir!r})
+
+        def f():
+            return [$qq|PyLong_FromLong(1)|]
+
+        def g():
+            return [$qq|PyLong_FromLong(2)|]
+        """,
+        cache_dir=str(tmpdir.join('cache')),
+    ))
+
+    threads = []
+    quote_sites = c_module.quote_sites
+
+    def recording_quote_sites(*args):
+        threads.append(current_thread())
+        return quote_sites(*args)
+
+    monkeypatch.setattr(c_module, 'quote_sites', recording_quote_sites)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        compiled = loop.run_until_complete(mod.qq.precompile_async(mod))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    # the source is analyzed in the executor, not on the event loop
+    assert len(threads) == 1
+    assert threads[0] is not current_thread()
+
+    # unused functions are held up to the cache size
+    assert len(compiled) == 2
+    assert len(mod.qq._warm) == 1
+    assert mod.f() == 1
+    assert mod.g() == 2
+
+
+def test_unknown_compiler():
+    with pytest.raises(ValueError):
+        c(compiler='not-a-compiler')
+
+
+@pytest.fixture
+def tcc():
+    try:
+        return TCC()
+    except OSError:
+        pytest.skip('libtcc is not installed')
+
+
+def test_tcc(tcc, tmpdir):
+    qq_tcc = c(compiler=tcc, cache_dir=str(tmpdir))
+    localvar = 'localvar'
+    assert [$qq_tcc|Py_INCREF(localvar); localvar|] is localvar
+
+
+def test_tiered(tmpdir):
+    def one(qq):
+        return [$qq|PyLong_FromLong(1)|]
+
+    qq_tiered = c(cache_dir=str(tmpdir), first_tier=GCC(optimize=0))
+    assert one(qq_tiered) == 1
+    ((first_tier,),) = map(dict.values, qq_tiered._expr_cache.values())
+
+    assert qq_tiered.wait()
+    ((optimized,),) = map(dict.values, qq_tiered._expr_cache.values())
+    assert optimized[0] is not first_tier[0]
+    assert optimized[1:] == first_tier[1:]
+    assert one(qq_tiered) == 1
+
+    # one shared object for each tier
+    assert len(tmpdir.join('c').listdir(no_locks)) == 2
+
+    # the optimized build is found in the cache and used immediately
+    qq_cached = c(cache_dir=str(tmpdir), first_tier=GCC(optimize=0))
+    assert one(qq_cached) == 1
+    assert not qq_cached._pending
+
+    # clearing the cache releases the background threads
+    background = qq_tiered._background
+    qq_tiered.cache_clear()
+    assert qq_tiered._background is None
+    assert background._shutdown
+
+
+def test_first_tier_gcc():
+    # the string 'gcc' is unoptimized gcc, not the optimizing default
+    assert c(first_tier='gcc')._first_tier._compiler.optimize == 0
+
+    with pytest.raises(ValueError):
+        c(first_tier=GCC())
+
+    with pytest.raises(ValueError):
+        c(compiler=GCC(optimize=0), first_tier='gcc')
+
+
+def test_batch(tmpdir, write_module, load_module):
+    source = write_module(
+        tmpdir,
+        'batched',
+        """\
+        # coding: quasiquotes
+        from quasiquotes.c import c
+
+        qq = c(batch=True, cache_dir={cache_dir!r})
+        other = c(cache_dir={cache_dir!r})
+
+        def f(a):
+            return [$qq|Py_INCREF(a); a|]
+
+        def g(a):
+            with $qq:
+                a = PyLong_FromLong(2);
+            return a
+
+        def h():
+            return [$other|PyLong_FromLong(3)|]
+        """,
+        cache_dir=str(tmpdir.join('cache')),
+    )
+    mod = load_module(source)
+    ob = object()
+    assert mod.f(ob) is ob
+    assert mod.g(1) == 2
+    assert mod.h() == 3
+
+    # both of the quasiquotes bound to ``qq`` are in a single batch, ``other``
+    # builds its own shared object
+    assert len(mod.qq._by_key) == 2
+    assert len(tmpdir.join('cache', 'c').listdir(no_locks)) == 2
+
+    # a new quasiquoter loads the cached batch
+    qq_batch = c(batch=True, cache_dir=str(tmpdir.join('cache')))
+    assert qq_batch.precompile(str(source), quasiquoters=('qq',)) == []
+    mod.qq = qq_batch
+    assert mod.f(ob) is ob
+    assert mod.g(1) == 2
+    assert len(mod.qq._by_key) == 2
+    assert len(tmpdir.join('cache', 'c').listdir(no_locks)) == 2
+
+
+def _mapped(path):
+    with open('/proc/self/maps') as f:
+        return path in f.read()
+
+
+def test_cache_size(tmpdir):
+    def one(qq):
+        return [$qq|PyLong_FromLong(1)|]
+
+    def two(qq):
+        return [$qq|PyLong_FromLong(2)|]
+
+    qq_bounded = c(cache_size=1, cache_dir=str(tmpdir))
+    assert one(qq_bounded) == 1
+    assert one(qq_bounded) == 1
+    (soname,) = map(str, tmpdir.join('c').listdir(no_locks))
+    assert qq_bounded.cache_info() == (1, 1, 0, 1, 1)
+    has_maps = os.path.exists('/proc/self/maps')
+    if has_maps:
+        assert _mapped(soname)
+
+    assert two(qq_bounded) == 2
+    assert qq_bounded.cache_info() == (1, 2, 1, 1, 1)
+    if has_maps:
+        # the evicted function's shared object was closed
+        assert not _mapped(soname)
+
+    # evicted functions are loaded again from the cache directory
+    assert one(qq_bounded) == 1
+    assert qq_bounded.cache_info() == (1, 3, 2, 1, 1)
+    assert len(tmpdir.join('c').listdir(no_locks)) == 2
+
+    qq_bounded.cache_clear()
+    assert qq_bounded.cache_info() == (0, 0, 0, 0, 1)
+
+
+def test_cache_size_threads(tmpdir):
+    def one(qq):
+        return [$qq|PyLong_FromLong(1)|]
+
+    def two(qq):
+        return [$qq|PyLong_FromLong(2)|]
+
+    # hits and evictions race between the threads
+    qq_bounded = c(cache_size=1, cache_dir=str(tmpdir))
+    barrier = Barrier(4)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append([f(qq_bounded) for _ in range(200) for f in (one, two)])
+
+    threads = [Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [[1, 2] * 200] * 4
+    assert qq_bounded.cache_info().entries <= 1
+
+
+def test_invalid_cache_size():
+    with pytest.raises(ValueError):
+        c(cache_size=0)
+
+
+class CountingGCC(GCC):
+    def __init__(self):
+        super().__init__()
+        self.compiles = 0
+
+    def compile(self, cname, soname, extra_compile_args):
+        self.compiles += 1
+        return super().compile(cname, soname, extra_compile_args)
+
+
+def test_concurrent_build(tmpdir):
+    def one(qq):
+        return [$qq|PyLong_FromLong(1)|]
+
+    compiler = CountingGCC()
+    # two quasiquoters sharing a cache directory coordinate with a file lock
+    qqs = [c(compiler=compiler, cache_dir=str(tmpdir)) for _ in range(2)]
+    barrier = Barrier(8)
+    results = []
+
+    def run(qq):
+        barrier.wait()
+        results.append(one(qq))
+
+    threads = [Thread(target=run, args=(qqs[n % 2],)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [1] * 8
+    assert compiler.compiles == 1
+    # the lock file is removed once the shared object is in place
+    assert len(tmpdir.join('c').listdir(no_locks)) == 1
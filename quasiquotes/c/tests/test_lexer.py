@@ -0,0 +1,70 @@
+from quasiquotes.c.lexer import (
+    assigned_names,
+    declared_names,
+    free_names,
+    tokenize,
+)
+
+
+def test_tokenize_skips_comments_and_directives():
+    code = '''
+    #include "frameobject.h"
+    /* a; b */
+    a = b; // c
+    '''
+    assert list(tokenize(code)) == [
+        ('name', 'a'),
+        ('op', '='),
+        ('name', 'b'),
+        ('op', ';'),
+    ]
+
+
+def test_free_names_in_scope():
+    code = 'Py_INCREF(a); PyList_SetItem(out, 0, a); b;'
+    assert free_names(code, {'a', 'out'}) == ('a', 'out')
+
+
+def test_free_names_ignores_non_variables():
+    code = '''
+    struct a *p = s.a;
+    p->a;
+    goto a;
+    a(1);
+    "a"; 'a';
+    int long;
+    '''
+    assert free_names(code, {'a', 'long'}) == ()
+
+
+def test_declared_names():
+    code = '''
+    long i;
+    PyObject *a = PyTuple_Pack(2, b, c), *d;
+    const char *e[2];
+    for (Py_ssize_t f = 0; f < g; ++f) {
+        struct h *k = l * m;
+    }
+    n = (PyObject *) o;
+    p(q * r, s);
+    '''
+    assert declared_names(code) == set('iadefk')
+
+
+def test_free_names_skips_declared():
+    code = 'long i = n; PyObject *result = PyLong_FromLong(i);'
+    assert free_names(code, {'i', 'n', 'result'}) == ('n',)
+
+
+def test_assigned_names():
+    code = '''
+    a = b;
+    c += 1;
+    d++;
+    --e;
+    PyArg_Parse(args, "O", &f);
+    g == h;
+    i->j = k;
+    '''
+    names = 'abcdefghijk'
+    assert assigned_names(code, names) == tuple('acdef')
@@ -0,0 +1,90 @@
+from functools import lru_cache
+from hashlib import sha256
+import os
+import sys
+from tempfile import mkstemp
+
+from .tokenizer import transform_string
+from ..utils.cache import cache_dir, publish
+
+
+#: The version of the transform's output. This must be incremented whenever
+#: a change to the tokenizer changes the code it emits so that stale entries
+#: in the on disk cache are not used.
+TRANSFORM_VERSION = 3
+
+#: The number of transformed sources to keep in memory.
+MAXSIZE = 128
+
+
+def _cache_path(source):
+    path = cache_dir('codec', str(TRANSFORM_VERSION))
+    if path is None:
+        return None
+
+    # The cache may be shared by many interpreters, and the tokenizer's
+    # output differs between python versions.
+    h = sha256(sys.version.encode('utf-8'))
+    h.update(b'\0')
+    h.update(source.encode('utf-8'))
+    return os.path.join(path, h.hexdigest() + '.py')
+
+
+@lru_cache(MAXSIZE)
+def cached_transform(source):
+    """Run a str through the tokenizer and emit the pure python
+    representation, reusing the result of previous transforms of the same
+    source.
+
+    Parameters
+    ----------
+    source : str
+        The string to transform.
+
+    Returns
+    -------
+    transformed : str
+        The pure python representation of ``source``.
+
+    Notes
+    -----
+    The most recent transforms are cached in memory. When
+    ``QUASIQUOTES_CACHE_DIR`` is set, transforms are also cached on disk keyed
+    by the hash of the source and the python version so that they are shared
+    between processes.
+    """
+    # the disk cache is best effort, never fail to decode because of it
+    try:
+        path = _cache_path(source)
+    except OSError:
+        path = None
+
+    if path is not None:
+        try:
+            with open(path, encoding='utf-8', newline='') as f:
+                return f.read()
+        except OSError:
+            pass
+
+    transformed = transform_string(source)
+    if path is not None:
+        _write(path, transformed)
+
+    return transformed
+
+
+def _write(path, transformed):
+    try:
+        fd, tmp = mkstemp(prefix='_qq_tmp_', dir=os.path.dirname(path))
+    except OSError:
+        return
+
+    try:
+        with open(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(transformed)
+        publish(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
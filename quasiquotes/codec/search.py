@@ -2,25 +2,50 @@ from codecs import CodecInfo
 from encodings import utf_8
 from io import StringIO
 
-from .tokenizer import transform_string
+from .cache import cached_transform
+from .. import profiling
 
 utf8 = utf_8.getregentry()
 
 
+def _transform(cs):
+    if not profiling.enabled:
+        return cached_transform(cs)
+
+    with profiling.timed('decode', profiling.caller_filename()):
+        return cached_transform(cs)
+
+
 def decode(input, errors='strict'):
     cs, errors = utf_8.decode(input, errors)
-    return transform_string(cs), errors
+    return _transform(cs), errors
 
 
 class IncrementalDecoder(utf_8.IncrementalDecoder):
+    def __init__(self, errors='strict'):
+        super().__init__(errors)
+        self._pending = []
+
     def decode(self, input, final=False):
-        return transform_string(super().decode(input, final))
+        # A chunk may end in the middle of a quasiquote, the source can only
+        # be transformed once all of it has been read.
+        self._pending.append(super().decode(input, final))
+        if not final:
+            return ''
+
+        cs = ''.join(self._pending)
+        self._pending.clear()
+        return _transform(cs)
+
+    def reset(self):
+        super().reset()
+        self._pending.clear()
 
 
 class StreamReader(utf_8.StreamReader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.stream = StringIO(transform_string(self.stream.getvalue()))
+        self.stream = StringIO(_transform(self.stream.getvalue()))
 
 
 def search_function(encoding):
@@ -0,0 +1,86 @@
+import pytest
+
+from quasiquotes.codec import cache
+from quasiquotes.codec.tokenizer import transform_string
+from quasiquotes.utils.cache import _umask
+
+
+source = 'a = [$qq|body|]\n'
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def transform(cs):
+        calls.append(cs)
+        return transform_string(cs)
+
+    monkeypatch.setattr(cache, 'transform_string', transform)
+    cache.cached_transform.cache_clear()
+    yield calls
+    cache.cached_transform.cache_clear()
+
+
+def test_memory_cache(calls, monkeypatch):
+    monkeypatch.delenv('QUASIQUOTES_CACHE_DIR', raising=False)
+    expected = transform_string(source)
+    assert cache.cached_transform(source) == expected
+    assert cache.cached_transform(source) == expected
+    assert calls == [source]
+
+
+def test_disk_cache(calls, monkeypatch, tmpdir):
+    monkeypatch.setenv('QUASIQUOTES_CACHE_DIR', str(tmpdir))
+    expected = transform_string(source)
+    assert cache.cached_transform(source) == expected
+    assert calls == [source]
+
+    (entry,) = tmpdir.join('codec', str(cache.TRANSFORM_VERSION)).listdir()
+    assert entry.read() == expected
+
+    # a new process only has the disk cache
+    cache.cached_transform.cache_clear()
+    assert cache.cached_transform(source) == expected
+    assert calls == [source]
+
+    # the entry may be read by other users that share the cache
+    assert entry.stat().mode & 0o777 == 0o666 & ~_umask
+
+
+def test_disk_cache_python_version(calls, monkeypatch, tmpdir):
+    monkeypatch.setenv('QUASIQUOTES_CACHE_DIR', str(tmpdir))
+    cache.cached_transform(source)
+
+    # another interpreter sharing the cache does not use this one's output
+    monkeypatch.setattr(cache.sys, 'version', 'another python')
+    cache.cached_transform.cache_clear()
+    cache.cached_transform(source)
+    assert calls == [source, source]
+    entries = tmpdir.join('codec', str(cache.TRANSFORM_VERSION)).listdir()
+    assert len(entries) == 2
+
+
+def test_unusable_disk_cache(calls, monkeypatch, tmpdir):
+    expected = transform_string(source)
+
+    # the cache root cannot be created
+    root = tmpdir.join('file')
+    root.write('')
+    monkeypatch.setenv('QUASIQUOTES_CACHE_DIR', str(root))
+    assert cache.cached_transform(source) == expected
+
+    # the cache directory cannot be written to
+    def mkstemp(*args, **kwargs):
+        raise OSError('read-only file system')
+
+    monkeypatch.setenv('QUASIQUOTES_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setattr(cache, 'mkstemp', mkstemp)
+    cache.cached_transform.cache_clear()
+    assert cache.cached_transform(source) == expected
+    assert calls == [source, source]
+    assert not tmpdir.join(
+        'cache',
+        'codec',
+        str(cache.TRANSFORM_VERSION),
+    ).listdir()
@@ -0,0 +1,35 @@
+from quasiquotes.codec.search import IncrementalDecoder, decode
+
+
+def test_incremental_decode_split_quasiquote():
+    source = b'a = [$qq|body|]\nb = 1\n'
+    expected, _ = decode(source)
+
+    # a reader's buffer may end in the middle of a quasiquote
+    decoder = IncrementalDecoder()
+    split = source.index(b'body')
+    assert (
+        decoder.decode(source[:split]) +
+        decoder.decode(source[split:], final=True)
+    ) == expected
+
+
+def test_incremental_decode_reset():
+    decoder = IncrementalDecoder()
+    decoder.decode(b'a = [$qq|')
+    decoder.reset()
+    assert decoder.decode(b'b = 1\n', final=True) == 'b = 1\n'
+
+
+def test_read_through_codec(tmpdir):
+    # larger than the read buffer so that the file is decoded in chunks
+    source = ''.join(
+        'a{n} = [$qq|body{n}|]\n'.format(n=n) for n in range(2000)
+    )
+    path = tmpdir.join('source.py')
+    path.write(source)
+
+    expected, _ = decode(path.read_binary())
+    with open(str(path), encoding='quasiquotes') as f:
+        # iterating reads and decodes one buffer at a time
+        assert ''.join(f) == expected
@@ -1,59 +1,78 @@
-import pytest
-
 from quasiquotes.codec.tokenizer import (
-    PeekableIterator,
+    top_level_lines,
     transform_string,
 )
 
 
-@pytest.fixture
-def piter():
-    return PeekableIterator(iter(range(10)))
-
-
-def test_peekable_iter_strict(piter):
-    assert list(piter) == list(range(10))
-
-
-def test_peekable_iter_strict_after_peek(piter):
-    assert piter.peek(3) == (0, 1, 2)
-    assert list(piter) == list(range(10))
-
-
-def test_peek_more_than_length(piter):
-    assert piter.peek(20) == tuple(range(10))
-
-
-def test_lookahead_iter(piter):
-    for n in piter.lookahead_iter():
-        if n == 3:
-            break
-
-    assert list(piter) == list(range(3, 10))
-
-
-def test_consume_peeked_all(piter):
-    assert piter.peek(5) == (0, 1, 2, 3, 4)
-    piter.consume_peeked()
-    assert list(piter) == [5, 6, 7, 8, 9]
-
-
-def test_consume_peeked_n(piter):
-    assert piter.peek(5) == (0, 1, 2, 3, 4)
-    piter.consume_peeked(3)
-    assert list(piter) == list(range(3, 10))
-
-
 def test_decode_stmt():
     assert (
         transform_string('with $qq:\n    body') ==
-        "qq._quote_stmt(0,'    body')\n"
+        "qq._quote_stmt(0,'    body',0)\n"
     )
     assert (
         transform_string('with $qq:\n    body\nout') ==
-        "qq._quote_stmt(0,'    body\\n')\n\nout"
+        "qq._quote_stmt(0,'    body\\n',0)\n\nout"
     )
 
 
 def test_decode_expr():
-    assert transform_string('[$qq|body|]') == "qq._quote_expr(0,'     body')"
+    assert transform_string('[$qq|body|]') == "qq._quote_expr(0,'     body',0)"
+
+
+def test_top_level_lines():
+    source = (
+        'a = (1,\n'
+        '     2)\n'
+        'def f():\n'
+        '    """\n'
+        'not a statement\n'
+        '"""\n'
+        '# comment\n'
+        'b = 1 + \\\n'
+        '2\n'
+    )
+    assert top_level_lines(source) == [
+        0,
+        source.index('def'),
+        source.index('b ='),
+        len(source),
+    ]
+
+
+def test_verbatim_without_quotes():
+    source = 'a  =  (1 ,\n  2)\n'
+    assert transform_string(source) is source
+
+
+def test_only_quoted_statements_transformed():
+    source = (
+        'a  =  1\n'
+        'def f():\n'
+        '    with $qq:\n'
+        '        body\n'
+        '    return 1\n'
+        'b  =  2\n'
+    )
+    assert transform_string(source) == (
+        'a  =  1\n'
+        'def f():\n'
+        "    qq._quote_stmt(4,'        body\\n',0)\n"
+        '\n'
+        '    return 1\n'
+        'b  =  2\n'
+    )
+
+
+def test_site_ids():
+    source = (
+        'a = [$qq|a|]\n'
+        'def f():\n'
+        '    with $qq:\n'
+        '        b\n'
+        '    return 1\n'
+        'c = [$qq|c|]\n'
+    )
+    transformed = transform_string(source)
+    assert "'         a',0)" in transformed
+    assert "'        b\\n',1)" in transformed
+    assert "'         c',2)" in transformed
@@ -1,6 +1,7 @@
-from collections import deque
+from bisect import bisect_right
 from io import BytesIO
-from itertools import islice, chain, repeat
+from itertools import count, chain, repeat
+import re
 from token import (
     DEDENT,
     ENDMARKER,
@@ -20,285 +21,205 @@ from tokenize import (
 )
 
 
-class FuzzyTokenInfo(TokenInfo):
-    """A token info object that check equality only on ``type`` and ``string``.
+# ``(type, string)`` keys for the tokens that make up quasiquotes. The hot
+# loops compare these against ``token[:2]``.
+with_key = (NAME, 'with')
+dollar_key = (ERRORTOKEN, '$')
+spaceerror_key = (ERRORTOKEN, ' ')
+col_key = (OP, ':')
+nl_key = (NEWLINE, '\n')
+left_bracket_key = (OP, '[')
+pipe_key = (OP, '|')
+right_bracket_key = (OP, ']')
 
-    Parameters
-    ----------
-    type : int
-        The enum for the token type.
-    string : str
-        The string represnting the token.
-    start, end, line : any, optional
-        Ignored.
-    """
-    def __new__(cls, type, string, start=None, end=None, line=None):
-        return super().__new__(cls, type, string, start, end, line)
-
-    def __eq__(self, other):
-        return self.type == other.type and self.string == other.string
-    __req__ = __eq__
-
-    def __ne__(self, other):
-        return not self == other
-    __rne__ = __ne__
-
-
-with_tok = FuzzyTokenInfo(NAME, 'with')
-dollar_tok = FuzzyTokenInfo(ERRORTOKEN, '$')
-spaceerror_tok = FuzzyTokenInfo(ERRORTOKEN, ' ')
-col_tok = FuzzyTokenInfo(OP, ':')
-nl_tok = FuzzyTokenInfo(NEWLINE, '\n')
-left_bracket_tok = FuzzyTokenInfo(OP, '[')
-pipe_tok = FuzzyTokenInfo(OP, '|')
-right_bracket_tok = FuzzyTokenInfo(OP, ']')
-
-
-class PeekableIterator:
-    """An iterator that can peek at the next ``n`` elements without
-    consuming them.
-
-    Parameters
-    ----------
-    stream : iterator
-        The underlying iterator to pull from.
-
-    Notes
-    -----
-    Peeking at ``n`` items will pull that many values into memory until
-    they have been consumed with ``next``.
 
-    The underlying iterator should not be consumed while the
-    ``PeekableIterator`` is in use.
-    """
-    def __init__(self, stream):
-        self._stream = iter(stream)
-        self._peeked = deque()
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        try:
-            return self._peeked.popleft()
-        except IndexError:
-            return next(self._stream)
-
-    def peek(self, n=1):
-        """Return the next ``n`` elements of the iterator without consuming
-        them.
-
-        Parameters
-        ----------
-        n : int
-
-        Returns
-        -------
-        peeked : tuple
-            The next ``elements``
-
-        Examples
-        --------
-        >>> it = PeekableIterator(iter((1, 2, 3, 4)))
-        >>> it.peek(2)
-        (1, 2)
-        >>> next(it)
-        1
-        >>> it.peek(1)
-        (2,)
-        >>> next(it)
-        2
-        >>> next(it)
-        3
-        """
-        peeked = tuple(islice(self, None, n))
-        put = self._peeked.append
-        for item in peeked:
-            put(item)
-        return peeked
-
-    def consume_peeked(self, n=None):
-        if n is None:
-            self._peeked.clear()
-        else:
-            for _ in range(n):
-                self._peeked.popleft()
-
-    def lookahead_iter(self):
-        """Return an iterator that yields the next element and then consumes
-        it.
-
-        This is particularly useful for ``takewhile`` style functions where
-        you want to break when some predicate is matched but not consume the
-        element that failed the predicate.
-
-        Examples
-        --------
-        >>> it = PeekableIterator(iter((1, 2, 3)))
-        >>> for n in it.lookahead_iter():
-        ...     if n == 2:
-        ...         break
-        >>> next(it)
-        2
-        """
-        while True:
-            yield from self.peek(1)
-            try:
-                next(self)
-            except StopIteration:
-                break
-
-
-def quote_stmt_tokenizer(name, start, tok_stream):
+def quote_stmt_tokenizer(name, start, toks, n, site):
     """Tokenizer for quote_stmt.
 
     Parameters
     ----------
-    name : str
+    name : TokenInfo
         The name of the quasiquoter.
     start : TokenInfo
         The starting token.
-    tok_stream : iterator of TokenInfo
-        The token stream to pull from.
+    toks : list[TokenInfo]
+        All of the tokens in the source.
+    n : int
+        The index of the first token of the body in ``toks``.
+    site : int
+        The identifier for this quasiquote, unique within the source.
 
-    Yields
-    ------
-    The tokens needed to generate a quote_stmt.
+    Returns
+    -------
+    n : int
+        The index of the first token after the quoted statement.
+    quoted : list[TokenInfo]
+        The tokens needed to generate a quote_stmt.
     """
     ls = []
     append = ls.append
     prev_line = name.start[0]
     stack = 1
-    for u in tok_stream.lookahead_iter():
-        if u.type == INDENT:
+    ntoks = len(toks)
+    while n < ntoks:
+        u = toks[n]
+        n += 1
+        type_ = u.type
+        if type_ == INDENT:
             stack += 1
-        elif u.type == DEDENT:
+        elif type_ == DEDENT:
             stack -= 1
-
-        if not stack:
-            next(tok_stream)  # consume the dedent
-            break
+            if not stack:
+                break
 
         if u.start[0] > prev_line:
             prev_line = u.start[0]
             append(u.line)
 
+    quoted = []
+    emit = quoted.append
     end = start.start[0], start.start[1] + len(name.string)
-    yield name._replace(start=start.start, end=end, line='<line>')
+    emit(name._replace(start=start.start, end=end, line='<line>'))
     dot_end = end[0], end[1] + 1
-    yield TokenInfo(
+    emit(TokenInfo(
         type=OP,
         string='.',
         start=end,
         end=dot_end,
         line='<line>',
-    )
+    ))
     name_end = dot_end[0], dot_end[1] + len('_quote_stmt')
-    yield TokenInfo(
+    emit(TokenInfo(
         type=OP,
         string='_quote_stmt',
         start=dot_end,
         end=name_end,
         line='<line>',
-    )
+    ))
     open_end = name_end[0], name_end[1] + 1
-    yield TokenInfo(
+    emit(TokenInfo(
         type=OP,
         string='(',
         start=name_end,
         end=open_end,
         line='<line>',
-    )
+    ))
     offset_end = open_end[0], open_end[1] + len(str(open_end[1]))
-    yield TokenInfo(
+    emit(TokenInfo(
         type=NUMBER,
         string=str(start.start[1]),
         start=open_end,
         end=offset_end,
         line='<line>',
-    )
+    ))
     comma_end = offset_end[0], offset_end[1] + 1
-    yield TokenInfo(
+    emit(TokenInfo(
         type=OP,
         string=',',
         start=offset_end,
         end=comma_end,
         line='<line>',
-    )
+    ))
     if len(ls) == 1:
         str_end = comma_end[0], comma_end[1] + len(ls[-1]) + 2
     else:
         str_end = comma_end[0] + len(ls) - 1, len(ls[-1]) + 2
-    yield TokenInfo(
+    emit(TokenInfo(
         type=STRING,
         string=repr(''.join(ls)),
         start=comma_end,
         end=str_end,
         line='<line>',
-    )
-    close_end = str_end[0], str_end[1] + 1
-    yield TokenInfo(
+    ))
+    site_comma_end = str_end[0], str_end[1] + 1
+    emit(TokenInfo(
         type=OP,
-        string=')',
+        string=',',
         start=str_end,
+        end=site_comma_end,
+        line='<line>',
+    ))
+    site_end = site_comma_end[0], site_comma_end[1] + len(str(site))
+    emit(TokenInfo(
+        type=NUMBER,
+        string=str(site),
+        start=site_comma_end,
+        end=site_end,
+        line='<line>',
+    ))
+    close_end = site_end[0], site_end[1] + 1
+    emit(TokenInfo(
+        type=OP,
+        string=')',
+        start=site_end,
         end=close_end,
         line='<line>',
-    )
+    ))
 
     nl_end = close_end[0], close_end[1] + 1
-    yield TokenInfo(
+    emit(TokenInfo(
         type=NEWLINE,
         string='\n',
         start=close_end,
         end=nl_end,
         line='<line>',
-    )
+    ))
 
-    if tok_stream.peek(1)[0].type == ENDMARKER:
-        return
+    if n >= ntoks or toks[n].type == ENDMARKER:
+        return n, quoted
 
-    for n in range(nl_end[0] + 1, u.start[0]):
-        yield TokenInfo(
+    for row in range(nl_end[0] + 1, u.start[0]):
+        emit(TokenInfo(
             type=NL,
             string='\n',
-            start=(n, 0),
-            end=(n, 1),
+            start=(row, 0),
+            end=(row, 1),
             line='\n',
-        )
+        ))
+
+    return n, quoted
 
 
-def quote_expr_tokenizer(name, start, tok_stream):
+def quote_expr_tokenizer(name, start, toks, n, site):
     """Tokenizer for quote_expr.
 
     Parameters
     ----------
-    name : str
+    name : TokenInfo
         The name of the quasiquoter.
     start : TokenInfo
         The starting token.
-    tok_stream : iterator of TokenInfo
-        The token stream to pull from.
+    toks : list[TokenInfo]
+        All of the tokens in the source.
+    n : int
+        The index of the first token of the body in ``toks``.
+    site : int
+        The identifier for this quasiquote, unique within the source.
 
-    Yields
-    ------
-    The tokens needed to generate a quote_expr.
+    Returns
+    -------
+    n : int
+        The index of the first token after the quoted expression.
+    quoted : list[TokenInfo]
+        The tokens needed to generate a quote_expr.
     """
     ls = []
     append = ls.append
     prev_line = name.start[0] - 1
     was_pipe = False
-    for u in tok_stream:
-        if u == right_bracket_tok and was_pipe:
+    ntoks = len(toks)
+    while n < ntoks:
+        u = toks[n]
+        n += 1
+        key = u[:2]
+        if was_pipe and key == right_bracket_key:
             break
 
         if u.start[0] > prev_line:
             prev_line = u.start[0]
             append(u.line)
 
-        if u == pipe_tok:
-            was_pipe = True
-        else:
-            was_pipe = False
+        was_pipe = key == pipe_key
 
     # remove the start and end quotes.
     ls[0] = (
@@ -307,138 +228,182 @@ def quote_expr_tokenizer(name, start, tok_stream):
     )
     ls[-1] = ls[-1].rsplit('|]', 1)[0]
     tok_pos = start.end[0], start.end[1] + len(name.string)
-    yield name._replace(start=start.start, end=tok_pos, line='<line>')
-    yield TokenInfo(
+    quoted = [name._replace(start=start.start, end=tok_pos, line='<line>')]
+    emit = quoted.append
+    emit(TokenInfo(
         type=OP,
         string='.',
         start=tok_pos,
         end=tok_pos,
         line='<line>',
-    )
-    yield TokenInfo(
+    ))
+    emit(TokenInfo(
         type=OP,
         string='_quote_expr',
         start=tok_pos,
         end=tok_pos,
         line='<line>',
-    )
-    yield TokenInfo(
+    ))
+    emit(TokenInfo(
         type=OP,
         string='(',
         start=tok_pos,
         end=tok_pos,
         line='<line>',
-    )
-    yield TokenInfo(
+    ))
+    emit(TokenInfo(
         type=NUMBER,
         string=str(start.start[1]),
         start=tok_pos,
         end=tok_pos,
         line='<line>',
-    )
-    yield TokenInfo(
+    ))
+    emit(TokenInfo(
         type=OP,
         string=',',
         start=tok_pos,
         end=tok_pos,
         line='<line>',
-    )
-    yield TokenInfo(
+    ))
+    emit(TokenInfo(
         type=STRING,
         string=repr(''.join(ls)),
         start=tok_pos,
         end=tok_pos,
         line='<line>',
-    )
-    yield TokenInfo(
+    ))
+    emit(TokenInfo(
+        type=OP,
+        string=',',
+        start=tok_pos,
+        end=tok_pos,
+        line='<line>',
+    ))
+    emit(TokenInfo(
+        type=NUMBER,
+        string=str(site),
+        start=tok_pos,
+        end=tok_pos,
+        line='<line>',
+    ))
+    emit(TokenInfo(
         type=OP,
         string=')',
         start=tok_pos,
         end=tok_pos,
         line='<line>',
-    )
+    ))
+    return n, quoted
 
 
-def tokenize(readline):
+def tokenize(readline, sites=None):
     """Tokenizer for the quasiquotes language extension.
 
     Parameters
     ----------
     readline : callable
         A callable that returns the next line to tokenize.
+    sites : iterator[int], optional
+        The identifiers to give to each quasiquote, in order. Defaults to
+        counting up from 0.
 
     Yields
     ------
     t : TokenInfo
         The token stream.
     """
+    if sites is None:
+        sites = count()
+
     # force the token stream to use `utf-8` and ignore the encoding pragma.
-    tok_stream = PeekableIterator(_tokenize(
+    toks = list(_tokenize(
         chain(iter(readline, b''), repeat(b'')).__next__,
         'utf-8',
     ))
-    for t in tok_stream:
-        if t == with_tok:
-            try:
-                sp, dol, name, col, nl, indent = tok_stream.peek(6)
-            except ValueError:
-                yield t
+    match_quote = _quote_matchers.get
+    ntoks = len(toks)
+    n = 0
+    while n < ntoks:
+        t = toks[n]
+        n += 1
+        match = match_quote(t[:2])
+        if match is not None:
+            quoted = match(t, toks, n, sites)
+            if quoted is not None:
+                n, quoted = quoted
+                yield from quoted
                 continue
 
-            if (sp == spaceerror_tok and
-                    dol == dollar_tok and
-                    col == col_tok and
-                    nl == nl_tok and
-                    indent.type == INDENT):
-                tok_stream.consume_peeked(6)
-                yield from quote_stmt_tokenizer(name, t, tok_stream)
-                continue
+        yield t
 
-        elif t == left_bracket_tok:
-            try:
-                dol, name, pipe = tok_stream.peek(3)
-            except ValueError:
-                yield t
-                continue
 
-            if dol == dollar_tok and pipe == pipe_tok:
-                tok_stream.consume_peeked(3)
-                yield from quote_expr_tokenizer(name, t, tok_stream)
-                continue
+def _match_quote_stmt(t, toks, n, sites):
+    try:
+        sp, dol, name, col, nl, indent = toks[n:n + 6]
+    except ValueError:
+        return None
 
-        yield t
+    if (sp[:2] == spaceerror_key and
+            dol[:2] == dollar_key and
+            col[:2] == col_key and
+            nl[:2] == nl_key and
+            indent.type == INDENT):
+        return quote_stmt_tokenizer(name, t, toks, n + 6, next(sites))
+    return None
+
+
+def _match_quote_expr(t, toks, n, sites):
+    try:
+        dol, name, pipe = toks[n:n + 3]
+    except ValueError:
+        return None
+
+    if dol[:2] == dollar_key and pipe[:2] == pipe_key:
+        return quote_expr_tokenizer(name, t, toks, n + 3, next(sites))
+    return None
 
 
-def tokenize_bytes(bs):
+# Dispatch on the ``(type, string)`` of the token that may start a quote.
+_quote_matchers = {
+    with_key: _match_quote_stmt,
+    left_bracket_key: _match_quote_expr,
+}
+
+
+def tokenize_bytes(bs, sites=None):
     """Tokenize a bytes object.
 
     Parameters
     ----------
     bs : bytes
         The bytes to tokenize.
+    sites : iterator[int], optional
+        The identifiers to give to each quasiquote, in order.
 
     Yields
     ------
     t : TokenInfo
         The token stream.
     """
-    return tokenize(BytesIO(bs).readline)
+    return tokenize(BytesIO(bs).readline, sites)
 
 
-def tokenize_string(cs):
+def tokenize_string(cs, sites=None):
     """Tokenize a str object.
 
     Parameters
     ----------
     cs : str
         The string to tokenize.
+    sites : iterator[int], optional
+        The identifiers to give to each quasiquote, in order.
 
     Yields
     ------
     t : TokenInfo
         The token stream.
     """
-    return tokenize_bytes(cs.encode('utf-8'))
+    return tokenize_bytes(cs.encode('utf-8'), sites)
 
 
 def transform_bytes(bs):
@@ -457,6 +422,61 @@ def transform_bytes(bs):
     return untokenize(tokenize_bytes(bs))
 
 
+_quote_pattern = re.compile(r'with \$|\[\$')
+
+_logical_line_pattern = re.compile(
+    r"""
+    (?P<string>
+        '''(?:\\.|[^\\])*?'''
+        |\"\"\"(?:\\.|[^\\])*?\"\"\"
+        |'(?:\\.|[^'\\\n])*'
+        |"(?:\\.|[^"\\\n])*"
+    )
+    |(?P<comment>\#[^\n]*)
+    |(?P<continuation>\\\n)
+    |(?P<open>[(\[{])
+    |(?P<close>[)\]}])
+    |(?P<newline>\n(?=[^\s\#]))
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def top_level_lines(cs):
+    """Find the offsets of the lines that begin top level statements.
+
+    Parameters
+    ----------
+    cs : str
+        The source to scan.
+
+    Returns
+    -------
+    boundaries : list[int]
+        The sorted offsets of the first character of each unindented logical
+        line. This always starts with 0 and ends with ``len(cs)``.
+
+    Notes
+    -----
+    This is a scan with a single regular expression that only understands
+    strings, comments, brackets, and line continuations, which is enough to
+    find statement boundaries without running the full tokenizer.
+    """
+    boundaries = [0]
+    append = boundaries.append
+    depth = 0
+    for match in _logical_line_pattern.finditer(cs):
+        kind = match.lastgroup
+        if kind == 'open':
+            depth += 1
+        elif kind == 'close':
+            depth = max(depth - 1, 0)
+        elif kind == 'newline' and not depth:
+            append(match.end())
+    append(len(cs))
+    return boundaries
+
+
 def transform_string(cs):
     """Run a str through the tokenizer and emit the pure python representation.
 
@@ -467,7 +487,34 @@ def transform_string(cs):
 
     Returns
     -------
-    transformed : bytes
+    transformed : str
         The pure python representation of cs.
+
+    Notes
+    -----
+    Only the top level statements which may contain a quasiquote are
+    tokenized, the rest of the source is passed through verbatim.
     """
-    return untokenize(tokenize_string(cs)).decode('utf-8')
+    quotes = [match.start() for match in _quote_pattern.finditer(cs)]
+    if not quotes:
+        return cs
+
+    boundaries = top_level_lines(cs)
+    # number the quasiquotes across all of the chunks
+    sites = count()
+    out = []
+    append = out.append
+    prev = 0
+    for n in sorted({bisect_right(boundaries, q) - 1 for q in quotes}):
+        start = boundaries[n]
+        stop = boundaries[n + 1]
+        append(cs[prev:start])
+        chunk = cs[start:stop]
+        transformed = untokenize(tokenize_string(chunk, sites)).decode('utf-8')
+        append(transformed)
+        # A quoted statement at the end of a chunk does not know how many
+        # lines it spanned, pad the chunk so that line numbers are preserved.
+        append('\n' * (chunk.count('\n') - transformed.count('\n')))
+        prev = stop
+    append(cs[prev:])
+    return ''.join(out)
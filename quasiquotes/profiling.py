@@ -0,0 +1,274 @@
+import atexit
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import sys
+from threading import Lock
+from time import perf_counter
+
+
+#: The environment variable that turns on profiling when quasiquotes is
+#: imported. If the value ends in ``.json`` the results are written there as
+#: JSON at exit, otherwise a summary table is written to stderr.
+PROFILE_ENVVAR = 'QUASIQUOTES_PROFILE'
+
+#: Is profiling turned on? Instrumented code checks this before doing any
+#: work so that profiling is free when it is off.
+enabled = False
+
+_lock = Lock()
+_timings = {}
+_counters = Counter()
+_output = None
+_atexit_registered = False
+
+
+def enable(output=None):
+    """Start recording timings and cache statistics.
+
+    Parameters
+    ----------
+    output : str, optional
+        Where to write the results when the interpreter exits. Paths ending in
+        ``.json`` get the results as JSON, ``'-'`` writes a summary table to
+        stderr. By default nothing is written at exit.
+    """
+    global enabled, _output, _atexit_registered
+
+    enabled = True
+    _output = output
+    if output is not None and not _atexit_registered:
+        atexit.register(_dump_at_exit)
+        _atexit_registered = True
+
+
+def disable():
+    """Stop recording. Results that were already recorded are kept.
+    """
+    global enabled, _output
+
+    enabled = False
+    _output = None
+
+
+def reset():
+    """Forget all of the recorded results.
+    """
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+
+
+def record(event, label, seconds):
+    """Record the duration of an event.
+
+    Parameters
+    ----------
+    event : str
+        The type of event, for example: ``'decode'`` or ``'compile'``.
+    label : str
+        What the event happened to, for example a filename or a
+        ``filename:lineno`` for a quasiquote.
+    seconds : float
+        How long the event took.
+    """
+    with _lock:
+        timing = _timings.get((event, label))
+        if timing is None:
+            _timings[event, label] = [1, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+
+
+def count(counter, n=1):
+    """Increment a counter.
+
+    Parameters
+    ----------
+    counter : str
+        The name of the counter, for example: ``'c.cache_hit'``.
+    n : int, optional
+        The amount to increment by.
+    """
+    with _lock:
+        _counters[counter] += n
+
+
+@contextmanager
+def timed(event, label):
+    """Record the time spent in a ``with`` block when profiling is enabled.
+
+    Parameters
+    ----------
+    event : str
+        The type of event.
+    label : str
+        What the event happened to.
+
+    Notes
+    -----
+    Blocks that raise an exception are not recorded.
+    """
+    if not enabled:
+        yield
+        return
+
+    start = perf_counter()
+    yield
+    record(event, label, perf_counter() - start)
+
+
+def time_first_call(label, f, replace):
+    """Wrap a function so that its first call is recorded.
+
+    Parameters
+    ----------
+    label : str
+        What the event happened to.
+    f : callable
+        The function to time.
+    replace : callable[callable, callable]
+        Called with the wrapper and ``f`` after the first call. This should
+        put ``f`` back wherever the wrapper was stored.
+
+    Returns
+    -------
+    wrapper : callable
+        A function which forwards to ``f``.
+    """
+    def first_call(*args):
+        start = perf_counter()
+        try:
+            return f(*args)
+        finally:
+            record('first_call', label, perf_counter() - start)
+            replace(first_call, f)
+
+    return first_call
+
+
+def stats():
+    """The recorded results.
+
+    Returns
+    -------
+    stats : dict
+        A dict with two keys: ``'timings'``, a list of dicts with the
+        ``event``, ``label``, ``count``, and ``total`` seconds of each event
+        sorted by total time, and ``'counters'``, a dict of counter values.
+    """
+    with _lock:
+        timings = [
+            OrderedDict((
+                ('event', event),
+                ('label', label),
+                ('count', n),
+                ('total', total),
+            ))
+            for (event, label), (n, total) in _timings.items()
+        ]
+        counters = dict(_counters)
+
+    timings.sort(key=lambda timing: timing['total'], reverse=True)
+    return {'timings': timings, 'counters': counters}
+
+
+def dump_json(file):
+    """Write the recorded results as JSON.
+
+    Parameters
+    ----------
+    file : file-like
+        The file to write to.
+    """
+    json.dump(stats(), file, indent=2)
+
+
+def summary(limit=None):
+    """Format the recorded results as a table.
+
+    Parameters
+    ----------
+    limit : int, optional
+        Only show the ``limit`` slowest events.
+
+    Returns
+    -------
+    table : str
+        The formatted table.
+    """
+    s = stats()
+    lines = ['{:<12} {:>7} {:>11}  {}'.format(
+        'event',
+        'count',
+        'total (ms)',
+        'label',
+    )]
+    lines.extend(
+        '{event:<12} {count:>7} {total:>11.3f}  {label}'.format(
+            event=timing['event'],
+            count=timing['count'],
+            total=timing['total'] * 1000,
+            label=timing['label'],
+        )
+        for timing in s['timings'][:limit]
+    )
+    if s['counters']:
+        lines.append('')
+        lines.extend(
+            '{:<20} {:>7}'.format(name, n)
+            for name, n in sorted(s['counters'].items())
+        )
+    return '\n'.join(lines)
+
+
+def _dump_at_exit():
+    output = _output
+    if output is None:
+        return
+
+    if output.endswith('.json'):
+        with open(output, 'w') as f:
+            dump_json(f)
+    else:
+        print(summary(), file=sys.stderr)
+
+
+_frame_filename_locals = ('path', 'filename', 'fullname', 'pathname')
+
+
+def caller_filename(default='<unknown>'):
+    """Best effort search of the stack for the name of the file being
+    decoded.
+
+    Codecs are only given the bytes to decode, so this looks for a local
+    variable with a path to a python file in the frames that are decoding,
+    for example the ``path`` argument of the import system's
+    ``source_to_code``.
+
+    Parameters
+    ----------
+    default : str, optional
+        The value to return when no filename is found.
+
+    Returns
+    -------
+    filename : str
+        The filename or ``default``.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        f_locals = frame.f_locals
+        for name in _frame_filename_locals:
+            value = f_locals.get(name)
+            if isinstance(value, str) and value.endswith('.py'):
+                return value
+        frame = frame.f_back
+    return default
+
+
+if os.environ.get(PROFILE_ENVVAR):
+    _value = os.environ[PROFILE_ENVVAR]
+    enable(_value if _value.endswith('.json') else '-')
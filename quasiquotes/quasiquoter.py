@@ -30,7 +30,9 @@ class QuasiQuoter:
             raise TypeError("cannot construct instances of 'QuasiQuoter'")
         return super().__new__(cls)
 
-    def _quote_expr(self, col_offset, expr, _getframe=_getframe):
+    def _quote_expr(self, col_offset, expr, site=None, _getframe=_getframe):
+        # ``site`` identifies the quasiquote within its source file. It is
+        # ignored here, quasiquoters may override this to use it.
         return self.quote_expr(expr, _getframe(1), col_offset)
 
     @staticmethod
@@ -61,7 +63,7 @@ class QuasiQuoter:
         """
         self._quote_default(frame, 'expr')
 
-    def _quote_stmt(self, col_offset, stmt, _getframe=_getframe):
+    def _quote_stmt(self, col_offset, stmt, site=None, _getframe=_getframe):
         self.quote_stmt(stmt, _getframe(1), col_offset)
 
     def quote_stmt(self, stmt, frame, col_offset):
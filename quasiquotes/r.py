@@ -1,14 +1,150 @@
+from asyncio import wrap_future
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from itertools import chain
+from sys import _getframe
+from threading import Lock, RLock
 
 
+try:
+    import numpy as np
+except ImportError:
+    # numpy is only needed to copy arrays directly, see ``fast_numpy``
+    np = None
+import rpy2.rinterface as ri
 import rpy2.robjects as ro
-from rpy2.ipython.rmagic import converter, pyconverter
+from rpy2.ipython.rmagic import converter
 
 from .quasiquoter import QuasiQuoter
 from .utils.instance import instance
 
 
+_parse = ro.r['parse']
+_eval = ro.r['eval']
+_get = ro.r['get']
+_rm = ro.r['rm']
+_ls = ro.r['ls']
+_new_env = ro.r['new.env']
+_all_vars = ro.r['all.vars']
+_all_names = ro.r['all.names']
+_exists = ro.r['exists']
+_lock_binding = ro.r['lockBinding']
+_unlock_binding = ro.r['unlockBinding']
+
+_missing = object()
+
+# The embedded R interpreter is not thread safe, every call into R must hold
+# this lock. It is reentrant so that python code called from R may run
+# quasiquotes.
+_lock = RLock()
+_executor = None
+# guards creating ``_executor``, this must not wait on ``_lock`` because it
+# runs on the event loop's thread
+_executor_lock = Lock()
+
+
+def _r_executor():
+    """The thread that runs the R code for asynchronous quasiquotes.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(1)
+        return _executor
+
+
+# the R vector type and the layout of its data for each numpy dtype kind,
+# only the vector types that rpy2 can copy to and from a buffer are used
+_r_vector_types = {} if np is None else {
+    kind: (vector_type, np.dtype(dtype))
+    for kind, vector_type, dtype in (
+        ('f', ri.FloatSexpVector, 'float64'),
+        ('i', ri.IntSexpVector, 'int32'),
+        ('c', ri.ComplexSexpVector, 'complex128'),
+    )
+    if (hasattr(vector_type, 'from_memoryview') and
+        hasattr(vector_type, 'memoryview'))
+}
+
+# the range of an R integer, the smallest int32 is ``NA_integer_``
+_r_int_min = -2 ** 31
+_r_int_max = 2 ** 31 - 1
+
+
+def numpy_to_r(value):
+    """Convert a numeric numpy array into an R vector with a single copy.
+
+    Parameters
+    ----------
+    value : any
+        The value to convert.
+
+    Returns
+    -------
+    vector : rpy2.rinterface.SexpVector or None
+        The R vector, or None if ``value`` is not a numeric ndarray.
+
+    Notes
+    -----
+    Arrays which are not already fortran contiguous or do not have the same
+    layout as the R vector type are copied once more to convert them.
+
+    R integers are 32 bits and the smallest 32 bit integer is R's ``NA``.
+    Integer arrays with values outside of that range are not converted.
+    """
+    if np is None or type(value) is not np.ndarray:
+        return None
+
+    kind = value.dtype.kind
+    try:
+        vector_type, dtype = _r_vector_types[kind]
+    except KeyError:
+        return None
+
+    if kind == 'i' and value.dtype.itemsize >= dtype.itemsize and value.size:
+        if value.min() <= _r_int_min or value.max() > _r_int_max:
+            return None
+
+    data = np.asfortranarray(value, dtype=dtype)
+    vector = vector_type.from_memoryview(
+        memoryview(data.reshape(-1, order='F')),
+    )
+    if data.ndim != 1:
+        vector.do_slot_assign('dim', ri.IntSexpVector(data.shape))
+    return vector
+
+
+def r_to_numpy(vector):
+    """Convert a numeric R vector into a numpy array with a single copy.
+
+    Parameters
+    ----------
+    vector : rpy2.rinterface.Sexp
+        The R value to convert.
+
+    Returns
+    -------
+    array : np.ndarray or None
+        The array, or None if ``vector`` is not a plain numeric vector,
+        matrix, or array.
+    """
+    for vector_type, dtype in _r_vector_types.values():
+        if isinstance(vector, vector_type):
+            break
+    else:
+        return None
+
+    # other attributes, like a factor's class and levels, would be lost
+    attrs = set(vector.list_attrs())
+    if not attrs <= {'dim'}:
+        return None
+
+    data = np.frombuffer(vector.memoryview(), dtype=dtype)
+    if attrs:
+        data = data.reshape(tuple(vector.do_slot('dim')), order='F')
+    return data.copy(order='K')
+
+
 @instance
 class r(QuasiQuoter):
     """quasiquoter for inlining r.
@@ -19,11 +155,20 @@ class r(QuasiQuoter):
         The converter to use to convert PyObjects to r objects.
     rtopy : callable, optional
         The converter to use when converting r objects into PyObjects.
+    fast_numpy : bool, optional
+        Copy numeric numpy arrays to and from R vectors directly instead of
+        using ``pytor`` and ``rtopy``. This has no effect when numpy is not
+        installed. Defaults to True.
+    asynchronous : bool, optional
+        Quoted expressions return an :mod:`asyncio` future for their value
+        and run on a dedicated R thread so that they do not block the event
+        loop. Quoted statements are not supported. Defaults to False.
 
     Methods
     -------
     quote_stmt
     quote_expr
+    clear
 
     Notes
     -----
@@ -45,59 +190,262 @@ class r(QuasiQuoter):
 
     This is because of the way the quasiquotes lexer identifies quasiquote
     sections.
+
+    Only the python names that the R code refers to directly are converted.
+    Converted values are kept in an R environment owned by the quasiquoter
+    and are reused until the name is bound to a different python object, so
+    objects which are mutated in place between quotes must be rebound or
+    dropped with :meth:`clear`.
+
+    Quasiquotes may run in many threads, calls into R are serialized by a
+    lock around the embedded interpreter.
     """
-    def __init__(self, *, pytor=pyconverter, rtopy=converter.ri2py):
-        self._pytor = pyconverter
+    def __init__(self,
+                 *,
+                 pytor=converter.py2rpy,
+                 rtopy=converter.rpy2py,
+                 fast_numpy=True,
+                 asynchronous=False):
+        self._pytor = pytor
         self._rtopy = rtopy
+        self._fast_numpy = fast_numpy
+        self._asynchronous = asynchronous
+        with _lock:
+            self._env = _new_env(parent=ro.globalenv)
+        # maps the names bound in ``_env`` to the python object they were
+        # converted from
+        self._pushed = {}
+        # maps code objects to a dict from site to the parsed R code and the
+        # names it refers to
+        self._parsed = {}
 
     def __call__(self, *args, **kwargs):
         return type(self)(*args, **kwargs)
 
-    @contextmanager
-    def _tmprns(self, globals_, locals_, collect_updates):
-        pytor = self._pytor
-        items = dict(chain(globals_.items(), locals_.items())).items()
-        wrote = []
-        original_ns = {}
-        for d in (locals_, globals_):
-            is_locals = d is locals_
-            for name, value in items:
-                if name in wrote:
+    def clear(self):
+        """Forget all of the python values that have been converted to R.
+        """
+        with _lock:
+            self._env = _new_env(parent=ro.globalenv)
+            self._pushed.clear()
+
+    def _to_r(self, value):
+        if self._fast_numpy:
+            vector = numpy_to_r(value)
+            if vector is not None:
+                return vector
+        return self._pytor(value)
+
+    def _to_py(self, rval):
+        if self._fast_numpy:
+            array = r_to_numpy(rval)
+            if array is not None:
+                return array
+        return self._rtopy(rval)
+
+    def _bind(self, name, rval, value):
+        """Bind a converted value in the quasiquoter's R environment.
+
+        Parameters
+        ----------
+        name : str
+            The name to bind.
+        rval : rpy2.rinterface.Sexp
+            The R value.
+        value : any
+            The python value that ``rval`` was converted from.
+
+        Notes
+        -----
+        The binding is locked so that quoted code which uses ``<<-`` fails
+        instead of silently changing the saved value.
+        """
+        env = self._env
+        if name in self._pushed:
+            _unlock_binding(name, env)
+        env[name] = rval
+        _lock_binding(name, env)
+        # hold a reference so the id of ``value`` cannot be reused
+        self._pushed[name] = value
+
+    def _unbind(self, name):
+        if self._pushed.pop(name, _missing) is not _missing:
+            _unlock_binding(name, self._env)
+            _rm(list=name, envir=self._env)
+
+    def _push(self, names, globals_, locals_):
+        """Bind python values in the quasiquoter's R environment.
+
+        Parameters
+        ----------
+        names : iterable[str]
+            The names to bind.
+        globals_ : dict
+            The globals of the frame being executed in.
+        locals_ : dict
+            The locals of the frame being executed in.
+
+        Returns
+        -------
+        bound : list[str]
+            The names that were bound to a python value.
+        """
+        pushed = self._pushed
+        to_r = self._to_r
+        bound = []
+        for name in names:
+            try:
+                value = locals_[name]
+            except KeyError:
+                try:
+                    value = globals_[name]
+                except KeyError:
+                    # don't let a value pushed by an earlier quote leak in
+                    self._unbind(name)
                     continue
+
+            if pushed.get(name, _missing) is not value:
                 try:
-                    original_ns[name] = rval = pytor(value)
-                    ro.r.assign(name, rval)
-                    ro.r.assign('._qq_orig_' + name, rval)
-                    if is_locals:
-                        wrote.append(name)
+                    rval = to_r(value)
                 except NotImplementedError:
-                    pass
+                    self._unbind(name)
+                    continue
+                self._bind(name, rval, value)
+            bound.append(name)
 
-        updated_values = {}
+        return bound
+
+    def _resolve(self, code, f_code, site):
+        """Find the parsed R code for a quasiquote, parsing it the first time
+        the quasiquote runs.
+
+        Parameters
+        ----------
+        code : str
+            The R code.
+        f_code : code
+            The code object the quasiquote appears in.
+        site : hashable
+            The identifier of the quasiquote within ``f_code``.
+
+        Returns
+        -------
+        expr : rpy2.robjects.vectors.ExprVector
+            The parsed code.
+        names : frozenset[str]
+            The names of the variables read or assigned by the code, and the
+            names of called functions which are not defined in R's base
+            environment.
+        """
         try:
-            yield updated_values
-        finally:
-            rtopy = self._rtopy
-            if collect_updates:
-                updated_pred = rtopy(ro.r(('c(%s)' % (
-                    ', '.join(map(
-                        'identical(get({0!r}), ._qq_orig_{0})'.format,
-                        wrote
-                    )),
-                ))))
-                updated_values.update({
-                    name: rtopy(ro.r('get(%r)' % name))
-                    for name, pred in zip(wrote, updated_pred)
-                    if not pred
-                })
-        ro.r('rm(list=ls())')
-
-    def quote_expr(self, code, frame, col_offset):
-        with self._tmprns(frame.f_globals, frame.f_locals, False):
-            return self._rtopy(ro.r(code))
-
-    def quote_stmt(self, code, frame, col_offset):
-        with self._tmprns(frame.f_globals, frame.f_locals, True) as updates:
-            self._rtopy(ro.r(code))
+            sites = self._parsed[f_code]
+        except KeyError:
+            sites = self._parsed[f_code] = {}
+        try:
+            return sites[site]
+        except KeyError:
+            pass
+
+        expr = _parse(text=code)
+        names = set(_all_vars(expr))
+        # ``all.vars`` skips names in call position, which may be python
+        # values like an R function saved in a local. Leave out operators and
+        # the base functions so that they are not looked up on every run.
+        for name in _all_names(expr):
+            if name in names:
+                continue
+            if not _exists(name, envir=ro.baseenv, inherits=False)[0]:
+                names.add(name)
+
+        out = sites[site] = expr, frozenset(names)
+        return out
+
+    @contextmanager
+    def _tmprns(self, names, globals_, locals_, collect_updates):
+        bound = self._push(names, globals_, locals_)
+
+        # Evaluate in a child of the persistent environment so that the
+        # quoted code's assignments do not change the pushed values. R
+        # copies a value into the child the first time it is assigned to or
+        # modified, so the names bound in the child are exactly the names
+        # the code reassigned.
+        scope = _new_env(parent=self._env)
+        updated_values = {}
+        yield scope, updated_values
+
+        if not (collect_updates and bound):
+            return
+
+        assigned = set(_ls(envir=scope, **{'all.names': True}))
+        for name in bound:
+            if name not in assigned:
+                continue
+
+            rval = _get(name, envir=scope)
+            if self._fast_numpy:
+                value = r_to_numpy(rval)
+                if value is not None:
+                    # The array is an exact copy of the new R value, so save
+                    # it as the converted value of the array that is written
+                    # back instead of copying it to R again on the next
+                    # quote.
+                    self._bind(name, rval, value)
+                    updated_values[name] = value
+                    continue
+            updated_values[name] = self._rtopy(rval)
+
+    def _quote_stmt(self, col_offset, code, site=None, _getframe=_getframe):
+        self.quote_stmt(code, _getframe(1), col_offset, site)
+
+    def _quote_expr(self, col_offset, code, site=None, _getframe=_getframe):
+        return self.quote_expr(code, _getframe(1), col_offset, site)
+
+    def _expr(self, code, f_code, site, globals_, locals_):
+        with _lock:
+            expr, names = self._resolve(code, f_code, site)
+            with self._tmprns(names, globals_, locals_, False) as (scope, _):
+                return self._to_py(_eval(expr, envir=scope))
+
+    def quote_expr(self, code, frame, col_offset, site=None):
+        if site is None:
+            site = frame.f_lineno, col_offset
+        if not self._asynchronous:
+            return self._expr(
+                code,
+                frame.f_code,
+                site,
+                frame.f_globals,
+                frame.f_locals,
+            )
+
+        # The locals are copied now because the frame will keep running
+        # while the R code waits for its turn.
+        return wrap_future(_r_executor().submit(
+            self._expr,
+            code,
+            frame.f_code,
+            site,
+            frame.f_globals,
+            dict(frame.f_locals),
+        ))
+
+    def quote_stmt(self, code, frame, col_offset, site=None):
+        if self._asynchronous:
+            # there is nothing to await and the write back to the frame
+            # cannot happen from another thread
+            self._quote_default(frame, 'stmt')
+
+        if site is None:
+            site = frame.f_lineno, col_offset
+        with _lock:
+            expr, names = self._resolve(code, frame.f_code, site)
+            tmprns = self._tmprns(
+                names,
+                frame.f_globals,
+                frame.f_locals,
+                True,
+            )
+            with tmprns as (scope, updates):
+                _eval(expr, envir=scope)
         frame.f_locals.update(updates)
         self.locals_to_fast(frame)
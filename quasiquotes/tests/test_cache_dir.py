@@ -0,0 +1,27 @@
+import os
+
+from quasiquotes.utils import cache
+from quasiquotes.utils.cache import cache_dir
+
+
+def test_cache_dir(monkeypatch, tmpdir):
+    monkeypatch.delenv(cache.CACHE_DIR_ENVVAR, raising=False)
+    assert cache_dir('c') is None
+
+    monkeypatch.setenv(cache.CACHE_DIR_ENVVAR, str(tmpdir))
+    path = cache_dir('c')
+    assert path == str(tmpdir.join('c'))
+    assert os.path.isdir(path)
+
+
+def test_cache_dir_created_once(monkeypatch, tmpdir):
+    calls = []
+
+    def makedirs(path, exist_ok=False):
+        calls.append(path)
+        os.mkdir(path)
+
+    monkeypatch.setattr(cache.os, 'makedirs', makedirs)
+    for _ in range(2):
+        assert cache_dir('c', root=str(tmpdir)) == str(tmpdir.join('c'))
+    assert calls == [str(tmpdir.join('c'))]
@@ -0,0 +1,67 @@
+import json
+from io import StringIO
+
+import pytest
+
+from quasiquotes import profiling
+
+
+@pytest.fixture
+def profile():
+    profiling.reset()
+    profiling.enable()
+    try:
+        yield profiling
+    finally:
+        profiling.disable()
+        profiling.reset()
+
+
+def test_disabled_records_nothing():
+    profiling.reset()
+    with profiling.timed('compile', 'label'):
+        pass
+    assert profiling.stats() == {'timings': [], 'counters': {}}
+
+
+def test_c_events(profile, tmpdir, write_module, load_module):
+    source = write_module(
+        tmpdir,
+        'profiled',
+        """\
+        # coding: quasiquotes
+        from quasiquotes.c import c
+
+        qq = c(cache_dir={cache_dir!r})
+
+        def f():
+            return [$qq|PyLong_FromLong(1)|]
+        """,
+        cache_dir=str(tmpdir.join('cache')),
+    )
+    mod = load_module(source)
+    assert mod.f() == 1
+    assert mod.f() == 1
+
+    label = '{}:7'.format(source)
+    events = {
+        (timing['event'], timing['label']): timing['count']
+        for timing in profile.stats()['timings']
+    }
+    assert events[('decode', str(source))] == 1
+    for event in 'resolve', 'compile', 'load', 'first_call':
+        assert events[(event, label)] == 1
+
+    assert profile.stats()['counters'] == {
+        'c.cache_miss': 1,
+        'c.cache_hit': 1,
+    }
+
+    # the first call wrapper was replaced by the compiled function
+    ((entry,),) = map(dict.values, mod.qq._expr_cache.values())
+    assert type(entry[0]) is type(len)
+
+    out = StringIO()
+    profile.dump_json(out)
+    assert json.loads(out.getvalue()) == profile.stats()
+    assert label in profile.summary()
@@ -0,0 +1,146 @@
+# coding: quasiquotes
+import asyncio
+
+import pytest
+
+pytest.importorskip('rpy2', minversion='3.0')
+
+from quasiquotes.quasiquoter import QQNotImplementedError  # noqa
+from quasiquotes.r import r  # noqa
+
+
+@pytest.fixture
+def converted():
+    qq = r(fast_numpy=False)
+    converted = []
+    pytor = qq._pytor
+
+    def counting_pytor(value):
+        converted.append(value)
+        return pytor(value)
+
+    qq._pytor = counting_pytor
+    return qq, converted
+
+
+def test_only_referenced_names_converted(converted):
+    qq, converted = converted
+    a = 1
+    unused = 'unused'  # noqa
+
+    assert [$qq|a + 1|][0] == 2
+    assert converted == [1]
+
+
+def test_called_python_name(converted):
+    import rpy2.robjects as ro
+
+    qq, converted = converted
+    f = ro.r['sum']
+    a = 1
+
+    # names in call position are converted unless R's base defines them
+    assert [$qq|f(a, 2)|][0] == 3
+    assert len(converted) == 2
+    assert any(value is f for value in converted)
+
+
+def test_identity_reuse(converted):
+    qq, converted = converted
+    a = 1.5
+
+    for _ in range(2):
+        assert [$qq|a * 2|][0] == 3
+    assert converted == [1.5]
+
+    # a new object is converted again even where it was quoted before
+    a = 2.5
+    assert [$qq|a * 2|][0] == 5
+    assert converted == [1.5, 2.5]
+
+
+def test_write_back_only_reassigned():
+    qq = r(fast_numpy=False)
+    a = 1
+    b = 2
+
+    with $qq:
+        a <- b + 1
+
+    assert a[0] == 3
+    # ``b`` was only read so it is not replaced with the R value
+    assert b == 2
+    assert type(b) is int
+
+
+def test_superassign_locked_binding():
+    from rpy2.rinterface_lib.embedded import RRuntimeError
+
+    qq = r(fast_numpy=False)
+    a = 1
+
+    with pytest.raises(RRuntimeError):
+        with $qq:
+            a <<- 2
+
+    assert [$qq|a|][0] == 1
+
+
+def test_numpy_round_trip():
+    np = pytest.importorskip('numpy')
+    from quasiquotes.r import numpy_to_r
+
+    qq = r()
+
+    def converter(value):
+        raise AssertionError('converted without the fast path: %r' % (value,))
+
+    # the arrays are copied directly, the converters are never used
+    qq._pytor = qq._rtopy = converter
+
+    floats = np.arange(6, dtype='float64').reshape(2, 3)
+    out = [$qq|floats * 2|]
+    assert out.dtype == np.dtype('float64')
+    assert out.shape == (2, 3)
+    np.testing.assert_array_equal(out, floats * 2)
+
+    ints = np.arange(6, dtype='int32').reshape(3, 2)
+    out = [$qq|ints|]
+    assert out.dtype == np.dtype('int32')
+    assert out.shape == (3, 2)
+    np.testing.assert_array_equal(out, ints)
+
+    # values that are not R integers are left to the converter
+    assert numpy_to_r(np.array([2 ** 40])) is None
+    assert numpy_to_r(np.array([-2 ** 31], dtype='int32')) is None
+
+
+def test_async_quote_expr():
+    qq = r(asynchronous=True)
+    a = 2
+
+    async def run():
+        future = [$qq|a + 1|]
+        assert isinstance(future, asyncio.Future)
+        return await future
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        out = loop.run_until_complete(run())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert out[0] == 3
+
+
+def test_async_quote_stmt():
+    qq = r(asynchronous=True)
+    a = 1
+
+    with pytest.raises(QQNotImplementedError):
+        with $qq:
+            a <- 2
+
+    assert a == 1
@@ -0,0 +1,89 @@
+import asyncio
+import os
+
+import pytest
+
+from quasiquotes.utils import shell
+from quasiquotes.utils.shell import (
+    Executable,
+    Flag,
+    set_max_processes,
+    split_args,
+)
+
+
+@pytest.fixture
+def one_process():
+    set_max_processes(1)
+    yield shell._slots
+    set_max_processes(os.cpu_count() or 1)
+
+
+def test_call():
+    result = Executable('echo')('a b', "'c'")
+    assert result.out == "a b 'c'\n"
+    assert result.returncode == 0
+    assert result.elapsed >= 0
+
+
+def test_split_args():
+    assert split_args('-O2 -lm') == ('-O2', '-lm')
+    assert split_args(['-O2 -lm', "-DNAME='a b'"]) == (
+        '-O2',
+        '-lm',
+        '-DNAME=a b',
+    )
+
+    flag = Flag.O(2)
+    assert split_args([flag, '-lm']) == (flag, '-lm')
+
+
+def test_set_max_processes_while_running(one_process):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def run():
+        task = loop.create_task(Executable('sleep').call_async(0.5))
+        # wait for the call to take the only slot
+        for _ in range(100):
+            if not one_process.acquire(blocking=False):
+                break
+            one_process.release()
+            await asyncio.sleep(0.01)
+        set_max_processes(2)
+        return await task
+
+    try:
+        result = loop.run_until_complete(run())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert result.returncode == 0
+    # the call released the semaphore it acquired
+    assert one_process.acquire(blocking=False)
+
+
+def test_call_async_cancelled(one_process):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    one_process.acquire()
+
+    async def cancel():
+        task = loop.create_task(Executable('true').call_async())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    try:
+        loop.run_until_complete(cancel())
+        # the cancelled call is still waiting for the slot in the executor
+        one_process.release()
+        loop.run_until_complete(asyncio.sleep(0.05))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    # the slot the cancelled call took was given back
+    assert one_process.acquire(timeout=1)
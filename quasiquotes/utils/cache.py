@@ -0,0 +1,73 @@
+import os
+
+
+#: The environment variable that names the shared quasiquotes cache directory.
+CACHE_DIR_ENVVAR = 'QUASIQUOTES_CACHE_DIR'
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+_umask = _get_umask()
+
+# the cache directories that have already been created
+_created = set()
+
+
+def cache_dir(*parts, root=None):
+    """Find the directory used for persistent caching.
+
+    Parameters
+    ----------
+    *parts : str
+        Subdirectories of the cache root to join onto the result.
+    root : str, optional
+        The cache root. Defaults to the value of ``QUASIQUOTES_CACHE_DIR``.
+
+    Returns
+    -------
+    path : str or None
+        The absolute path to the (created) cache directory, or None if
+        caching is not configured.
+
+    Notes
+    -----
+    Each directory is only created the first time it is looked up.
+    """
+    if root is None:
+        root = os.environ.get(CACHE_DIR_ENVVAR)
+        if not root:
+            return None
+
+    path = os.path.join(os.path.abspath(os.path.expanduser(root)), *parts)
+    if path not in _created:
+        os.makedirs(path, exist_ok=True)
+        _created.add(path)
+    return path
+
+
+def publish(tmp, path, mode=0o666):
+    """Atomically move a temporary file into the cache.
+
+    Parameters
+    ----------
+    tmp : str
+        The path to the temporary file, for example from
+        :func:`tempfile.mkstemp`.
+    path : str
+        The path to move the file to.
+    mode : int, optional
+        The permissions to give the file before the process's umask is
+        applied.
+
+    Notes
+    -----
+    :func:`tempfile.mkstemp` creates files that only their owner may read.
+    The permissions are reset so that a cache directory may be shared by many
+    users.
+    """
+    os.chmod(tmp, mode & ~_umask)
+    os.replace(tmp, path)
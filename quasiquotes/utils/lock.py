@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on a file for the duration of a with block.
+
+    Parameters
+    ----------
+    path : str
+        The path to the lock file. This is created if it does not exist.
+
+    Notes
+    -----
+    The lock is taken with ``flock`` so it excludes other processes as well
+    as other threads which lock the same path. On platforms without
+    :mod:`fcntl` this does nothing.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # closing the file releases the lock
+        os.close(fd)
@@ -1,4 +1,17 @@
+from asyncio import (
+    CancelledError,
+    create_subprocess_exec,
+    get_event_loop,
+    shield,
+)
+from collections import namedtuple
+from itertools import chain
+import os
+from shlex import split
+from shutil import which
 from subprocess import Popen, PIPE, DEVNULL
+from threading import BoundedSemaphore
+from time import perf_counter
 
 
 class FlagMeta(type):
@@ -14,7 +27,7 @@ class Flag(metaclass=FlagMeta):
     def __str__(self):
         if self._arg is not None:
             fmtstr = (
-                '-{name}{arg!r}' if len(self._name) == 1 else '-{name}={arg!r}'
+                '-{name}{arg}' if len(self._name) == 1 else '-{name}={arg}'
             )
             return fmtstr.format(name=self._name, arg=self._arg)
         else:
@@ -28,26 +41,173 @@ class Flag(metaclass=FlagMeta):
         return self
 
 
+Result = namedtuple('Result', 'out err returncode elapsed')
+
+
+_slots = BoundedSemaphore(os.cpu_count() or 1)
+
+
+def set_max_processes(n):
+    """Set the number of subprocesses that executables may run at once.
+
+    Calls past this limit wait for a running process to exit. This is shared
+    by every ``Executable`` so that a burst of calls from many threads cannot
+    exhaust the process table.
+
+    Parameters
+    ----------
+    n : int
+        The maximum number of running subprocesses. Defaults to the number
+        of cpus.
+
+    Raises
+    ------
+    ValueError
+        Raised when ``n`` is less than 1.
+    """
+    global _slots
+
+    if n < 1:
+        raise ValueError('n must be at least 1, got %r' % n)
+    _slots = BoundedSemaphore(n)
+
+
+def split_args(args):
+    """Split string arguments into words the way a shell would.
+
+    Parameters
+    ----------
+    args : str or iterable[str or Flag]
+        The command line arguments.
+
+    Returns
+    -------
+    args : tuple[str or Flag]
+        The arguments with each string split into words.
+
+    Notes
+    -----
+    ``Executable`` does not run a shell, so this keeps code that passed
+    arguments like ``'-O2 -lm'`` working.
+    """
+    if isinstance(args, str):
+        args = (args,)
+    return tuple(chain.from_iterable(
+        split(arg) if isinstance(arg, str) else (arg,) for arg in args
+    ))
+
+
 class Executable(object):
     """
-    An executable from the shell.
+    An executable which is run as a subprocess.
+
+    Parameters
+    ----------
+    name : str
+        The name of or path to the executable.
+    cwd : str, optional
+        The working directory to run the executable in. Defaults to the
+        working directory of this process.
+    env : dict[str, str], optional
+        The environment to run the executable with. Defaults to the
+        environment of this process.
+
+    Notes
+    -----
+    The arguments are passed to the process directly instead of through a
+    shell, so they must not be quoted.
     """
-    def __init__(self, name):
+    def __init__(self, name, cwd=None, env=None):
         self._name = name
+        self.cwd = cwd
+        self.env = env
+
+    @property
+    def path(self):
+        """The resolved path to the executable, or the bare name if it cannot
+        be found on the ``PATH``.
+        """
+        path = which(self._name)
+        return os.path.realpath(path) if path is not None else self._name
+
+    def _argv(self, args):
+        return [self._name] + list(map(str, args))
+
+    def __call__(self, *args, stdin=None, stderr=PIPE):
+        """Run the executable.
+
+        Parameters
+        ----------
+        *args : str or Flag
+            The command line arguments.
+        stdin : bytes, optional
+            The data to write to the process's stdin.
+        stderr : file or int, optional
+            Where to send the process's stderr. By default it is collected
+            and returned. Passing a file streams the diagnostics to it as
+            they are written.
+
+        Returns
+        -------
+        result : Result
+            The process's stdout, its stderr if it was collected, its exit
+            status, and how long it ran for in seconds.
+        """
+        argv = self._argv(args)
+        # ``set_max_processes`` may replace the semaphore while this runs
+        slots = _slots
+        with slots:
+            start = perf_counter()
+            proc = Popen(
+                argv,
+                cwd=self.cwd,
+                env=self.env,
+                stdin=PIPE if stdin else DEVNULL,
+                stdout=PIPE,
+                stderr=stderr,
+            )
+            out, err = proc.communicate(stdin)
+            elapsed = perf_counter() - start
+
+        return Result(
+            out.decode('utf-8', 'replace'),
+            err.decode('utf-8', 'replace') if err is not None else '',
+            proc.returncode,
+            elapsed,
+        )
+
+    async def call_async(self, *args, stdin=None, stderr=PIPE):
+        """Run the executable as an asyncio subprocess. See ``__call__``.
+        """
+        argv = self._argv(args)
+        slots = _slots
+        # waiting for a slot blocks, so wait in the executor
+        acquire = get_event_loop().run_in_executor(None, slots.acquire)
+        try:
+            await shield(acquire)
+        except CancelledError:
+            # the executor still takes the slot, give it back once it does
+            acquire.add_done_callback(lambda _: slots.release())
+            raise
 
-    def __call__(self, *args, **kwargs):
-        stdin = kwargs.pop('stdin', None)
-        if kwargs:
-            raise TypeError(
-                'unexpected keyword arguments: %s' % kwargs.keys(),
+        try:
+            start = perf_counter()
+            proc = await create_subprocess_exec(
+                *argv,
+                cwd=self.cwd,
+                env=self.env,
+                stdin=PIPE if stdin else DEVNULL,
+                stdout=PIPE,
+                stderr=stderr
             )
+            out, err = await proc.communicate(stdin)
+            elapsed = perf_counter() - start
+        finally:
+            slots.release()
 
-        proc = Popen(
-            '%s %s' % (self._name, ' '.join(map(str, args))),
-            shell=True,
-            stdin=PIPE if stdin else DEVNULL,
-            stdout=PIPE,
-            stderr=PIPE,
+        return Result(
+            out.decode('utf-8', 'replace'),
+            err.decode('utf-8', 'replace') if err is not None else '',
+            proc.returncode,
+            elapsed,
         )
-        out, err = proc.communicate(stdin)
-        return out.decode('utf-8'), err.decode('utf-8'), proc.returncode
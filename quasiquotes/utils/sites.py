@@ -0,0 +1,147 @@
+import ast
+import builtins
+from collections import namedtuple
+import symtable
+
+from ..codec.tokenizer import transform_string
+
+
+class QuoteSite(namedtuple('QuoteSite', (
+        'kind',
+        'name',
+        'lineno',
+        'col_offset',
+        'code',
+        'scope',
+))):
+    """A quasiquote found in some source code.
+
+    Parameters
+    ----------
+    kind : {'stmt', 'expr'}
+        The type of quasiquote.
+    name : str
+        The name of the quasiquoter.
+    lineno : int
+        The line that the quasiquote starts on.
+    col_offset : int
+        The column offset of the quasiquoter.
+    code : str
+        The quoted body, exactly as it is passed to the quasiquoter.
+    scope : frozenset[str]
+        The names that are statically visible from the quasiquote.
+    """
+    __slots__ = ()
+
+
+_module_names = frozenset({
+    '__builtins__',
+    '__cached__',
+    '__doc__',
+    '__file__',
+    '__loader__',
+    '__name__',
+    '__package__',
+    '__spec__',
+}) | frozenset(vars(builtins))
+
+_quote_methods = {'_quote_stmt': 'stmt', '_quote_expr': 'expr'}
+
+_child_table_names = {
+    ast.Lambda: 'lambda',
+    ast.ListComp: 'listcomp',
+    ast.SetComp: 'setcomp',
+    ast.DictComp: 'dictcomp',
+    ast.GeneratorExp: 'genexpr',
+}
+
+
+def _child_table(table, node):
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        name = node.name
+    else:
+        name = _child_table_names.get(type(node))
+        if name is None:
+            return None
+
+    for child in table.get_children():
+        if child.get_name() == name and child.get_lineno() == node.lineno:
+            return child
+    return None
+
+
+def _site(node, scope):
+    if not (isinstance(node, ast.Call) and
+            isinstance(node.func, ast.Attribute) and
+            node.func.attr in _quote_methods and
+            isinstance(node.func.value, ast.Name) and
+            len(node.args) >= 2):
+        return None
+
+    try:
+        col_offset = ast.literal_eval(node.args[0])
+        code = ast.literal_eval(node.args[1])
+    except ValueError:
+        return None
+
+    return QuoteSite(
+        kind=_quote_methods[node.func.attr],
+        name=node.func.value.id,
+        lineno=node.lineno,
+        col_offset=col_offset,
+        code=code,
+        scope=scope,
+    )
+
+
+def quote_sites(source, filename='<string>'):
+    """Find all of the quasiquotes in some quasiquotes source code.
+
+    Parameters
+    ----------
+    source : str
+        The source code, before it has been transformed by the quasiquotes
+        codec.
+    filename : str, optional
+        The filename to use in syntax errors.
+
+    Returns
+    -------
+    sites : list[QuoteSite]
+        The quasiquotes in the order they appear in the source.
+
+    Notes
+    -----
+    The scope of each site is computed statically, so names that are
+    created dynamically, for example with ``from module import *``, will not
+    be included.
+    """
+    source = transform_string(source)
+    module_table = symtable.symtable(source, filename, 'exec')
+    module_scope = _module_names | frozenset(
+        symbol.get_name()
+        for symbol in module_table.get_symbols()
+        if symbol.is_assigned() or symbol.is_imported()
+    )
+
+    sites = []
+
+    def visit(node, table, scope):
+        site = _site(node, scope)
+        if site is not None:
+            sites.append(site)
+
+        for child in ast.iter_child_nodes(node):
+            child_table = _child_table(table, child)
+            if child_table is None:
+                visit(child, table, scope)
+            else:
+                visit(child, child_table, module_scope | frozenset(
+                    symbol.get_name()
+                    for symbol in child_table.get_symbols()
+                    if symbol.is_local() or symbol.is_free()
+                ))
+
+    visit(ast.parse(source, filename), module_table, module_scope)
+    sites.sort(key=lambda site: (site.lineno, site.col_offset))
+    return sites
@@ -41,7 +41,7 @@ def subcmd(cmd):
 
 
 def extras_require():
-    r = ['rpy2']
+    r = ['rpy2>=3.0']
 
     return {
         'r': r,
@@ -64,7 +64,8 @@ if __name__ == '__main__':
             'Development Status :: 3 - Alpha',
             'License :: OSI Approved :: GNU General Public License v2 (GPLv2)',
             'Natural Language :: English',
-            'Programming Language :: Python :: 3.4',
+            'Programming Language :: Python :: 3.5',
+            'Programming Language :: Python :: 3.6',
             'Programming Language :: Python :: 3 :: Only',
             'Topic :: Software Development :: Pre-processors',
         ],
@@ -72,5 +73,6 @@ if __name__ == '__main__':
             Extension('quasiquotes.c._loader', ['quasiquotes/c/_loader.c']),
         ],
         url='https://github.com/llllllllll/quasiquotes',
+        python_requires='>=3.5',
         extras_require=extras_require(),
     )